@@ -0,0 +1,325 @@
+"""Load generator for the CSI plugin.
+
+Starts the Identity/Controller/Node servicers in-process on a Unix socket,
+drives a weighted mix of RPCs at a fixed concurrency over a real gRPC
+channel and reports throughput and latency percentiles per operation.
+
+    python bench/csi_bench.py --duration 30 --concurrency 32 \\
+        --mix create=2,delete=2,list=1,get=4,publish=1,stats=8 \\
+        --output results.json
+
+--baseline compares against the --output of an earlier run on the same
+machine (e.g. before a change) and exits with 1 on regressions beyond
+--tolerance; no baseline ships with the repo, as numbers are host-specific.
+
+With --backend fake the services run against the in-memory filesystem and
+mount table, which needs no root and measures only the plugin's own
+overhead, e.g. at --prepopulate 100000. --backend recording wraps the real
+host and reports the time spent in each filesystem/mount operation.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import shutil
+import argparse
+import tempfile
+import threading
+import itertools
+from concurrent import futures
+
+import grpc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csi import csi_pb2 as pb  # noqa: E402
+from csi import csi_pb2_grpc as pb_grpc  # noqa: E402
+from csi.identity_service import IdentityService  # noqa: E402
+from csi.controller_service import ControllerService  # noqa: E402
+from csi.node_service import NodeService  # noqa: E402
+from csi.volume_catalog import VolumeCatalog  # noqa: E402
+from csi.backend import RecordingBackend, new_backend  # noqa: E402
+
+OPERATIONS = ("create", "delete", "list", "get", "publish", "stats", "probe")
+DEFAULT_MIX = "create=2,delete=2,list=1,get=4,publish=1,stats=8,probe=1"
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {OPERATIONS}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, op, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(op, []).append(seconds)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def summary(self, elapsed):
+        result = {}
+        for op, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[op] = {
+                "count": len(values),
+                "errors": self.errors.get(op, 0),
+                "throughput": len(values) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+        return result
+
+
+class Workload:
+    """Issues one randomly chosen operation per call against live stubs."""
+
+    def __init__(self, channel, workdir, mix, recorder):
+        self.identity = pb_grpc.IdentityStub(channel)
+        self.controller = pb_grpc.ControllerStub(channel)
+        self.node = pb_grpc.NodeStub(channel)
+        self.workdir = workdir
+        self.ops = list(mix)
+        self.weights = [mix[op] for op in self.ops]
+        self.recorder = recorder
+        self._lock = threading.Lock()
+        self._volumes = []   # (volume_id, path) created and not yet deleted
+        self._ids = itertools.count()
+        self.staging = os.path.join(workdir, "staging")
+
+    def _timed(self, op, call):
+        start = time.perf_counter()
+        ok = True
+        try:
+            return call()
+        except grpc.RpcError:
+            ok = False
+        finally:
+            self.recorder.record(op, time.perf_counter() - start, ok)
+
+    def _pick_volume(self, remove=False):
+        with self._lock:
+            if not self._volumes:
+                return None
+            index = random.randrange(len(self._volumes))
+            if remove:
+                return self._volumes.pop(index)
+            return self._volumes[index]
+
+    def create(self):
+        volume_id = f"bench-{os.getpid()}-{next(self._ids)}"
+        response = self._timed("create", lambda: self.controller.CreateVolume(pb.CreateVolumeRequest(
+            name=volume_id, capacity_range=pb.CapacityRange(required_bytes=1 << 20))))
+        if response is not None:
+            with self._lock:
+                self._volumes.append((volume_id, response.volume.volume_context["path"]))
+
+    def delete(self):
+        volume = self._pick_volume(remove=True)
+        if volume is None:
+            return self.create()
+        self._timed("delete", lambda: self.controller.DeleteVolume(
+            pb.DeleteVolumeRequest(volume_id=volume[0])))
+
+    def list(self):
+        self._timed("list", lambda: self.controller.ListVolumes(pb.ListVolumesRequest(max_entries=100)))
+
+    def get(self):
+        volume = self._pick_volume()
+        if volume is None:
+            return self.create()
+        self._timed("get", lambda: self.controller.ControllerGetVolume(
+            pb.ControllerGetVolumeRequest(volume_id=volume[0])))
+
+    def publish(self):
+        volume = self._pick_volume()
+        if volume is None:
+            return self.create()
+        target = os.path.join(self.workdir, "targets", f"{volume[0]}-{next(self._ids)}")
+        published = self._timed("publish", lambda: self.node.NodePublishVolume(pb.NodePublishVolumeRequest(
+            volume_id=volume[0], target_path=target, staging_target_path=self.staging,
+            volume_context={"path": volume[1]})))
+        if published is not None:
+            self._timed("stats", lambda: self.node.NodeGetVolumeStats(
+                pb.NodeGetVolumeStatsRequest(volume_id=volume[0], volume_path=target)))
+        self._timed("unpublish", lambda: self.node.NodeUnpublishVolume(
+            pb.NodeUnpublishVolumeRequest(volume_id=volume[0], target_path=target)))
+
+    def stats(self):
+        volume = self._pick_volume()
+        if volume is None:
+            return self.create()
+        self._timed("stats", lambda: self.node.NodeGetVolumeStats(
+            pb.NodeGetVolumeStatsRequest(volume_id=volume[0], volume_path=volume[1])))
+
+    def probe(self):
+        self._timed("probe", lambda: self.identity.Probe(pb.ProbeRequest()))
+
+    def step(self):
+        getattr(self, random.choices(self.ops, self.weights)[0])()
+
+
+def start_server(args, workdir, backend):
+    socket_path = os.path.join(workdir, "csi.sock")
+    volume_root = os.path.join(workdir, "volumes")
+    # What kubelet would have done before NodePublishVolume
+    backend.makedirs(os.path.join(workdir, "staging"), exist_ok=True)
+    catalog = None
+    if args.backend == "fake":
+        # The volume root only exists in memory, so the catalog cannot live in it
+        catalog = VolumeCatalog(volume_root, db_path=":memory:", backend=backend)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.server_workers))
+    pb_grpc.add_IdentityServicer_to_server(IdentityService("bench.csi.k8s.io"), server)
+    pb_grpc.add_ControllerServicer_to_server(
+        ControllerService(volume_root, catalog=catalog, backend=backend), server)
+    pb_grpc.add_NodeServicer_to_server(NodeService("bench-node", backend), server)
+    endpoint = f"unix://{socket_path}"
+    server.add_insecure_port(endpoint)
+    server.start()
+    return server, endpoint
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="csi-bench-", dir=args.workdir)
+    backend = new_backend(args.backend, args.mounter)
+    server, endpoint = start_server(args, workdir, backend)
+    channel = grpc.insecure_channel(endpoint)
+    grpc.channel_ready_future(channel).result(timeout=10)
+    try:
+        recorder = Recorder()
+        workload = Workload(channel, workdir, args.mix, recorder)
+        with futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for _ in range(args.prepopulate):
+                pool.submit(workload.create)
+        recorder = workload.recorder = Recorder()
+        if isinstance(backend, RecordingBackend):
+            backend.reset()
+
+        deadline = time.monotonic() + args.duration
+        remaining = itertools.count(args.requests, -1) if args.requests else None
+        remaining_lock = threading.Lock()
+
+        def worker():
+            while time.monotonic() < deadline:
+                if remaining is not None:
+                    with remaining_lock:
+                        if next(remaining) <= 0:
+                            return
+                workload.step()
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+    finally:
+        channel.close()
+        server.stop(grace=None)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "config": {
+            "concurrency": args.concurrency,
+            "server_workers": args.server_workers,
+            "mix": args.mix,
+            "backend": args.backend,
+            "mounter": args.mounter,
+            "prepopulate": args.prepopulate,
+        },
+        "elapsed_s": elapsed,
+        "operations": recorder.summary(elapsed),
+    }
+    if isinstance(backend, RecordingBackend):
+        results["backend_calls"] = backend.summary()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions of `results` against `baseline`."""
+    regressions = []
+    for op, base in baseline.get("operations", {}).items():
+        current = results["operations"].get(op)
+        if current is None:
+            continue
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if base[key] > 0 and current[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{op} {key}: {current[key]:.3f} > {base[key]:.3f} (+{tolerance:.0%} allowed)")
+        if base["throughput"] > 0 and current["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{op} throughput: {current['throughput']:.1f}/s < {base['throughput']:.1f}/s")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'op':<10} {'count':>8} {'errors':>7} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for op, s in results["operations"].items():
+        print(f"{op:<10} {s['count']:>8} {s['errors']:>7} {s['throughput']:>10.1f} "
+              f"{s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['p99_ms']:>9.3f}")
+    if "backend_calls" in results:
+        print()
+        print(f"{'backend':<14} {'calls':>8} {'errors':>7} {'total ms':>10} {'mean us':>9}")
+        for op, s in results["backend_calls"].items():
+            print(f"{op:<14} {s['count']:>8} {s['errors']:>7} {s['seconds'] * 1000:>10.1f} "
+                  f"{s['seconds'] / s['count'] * 1e6:>9.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='CSI plugin benchmark')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='Stop after this many operations (0 = duration only)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client workers')
+    parser.add_argument('--server-workers', type=int, default=10, help='gRPC server thread pool size')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f'Weighted operation mix (default {DEFAULT_MIX})')
+    parser.add_argument('--prepopulate', type=int, default=100, help='Volumes created before measuring')
+    parser.add_argument('--backend', choices=['os', 'fake', 'recording'], default='os',
+                        help='Filesystem/mount backend: the real host, in-memory, or the host with per-call timing')
+    parser.add_argument('--mounter', choices=['syscall', 'subprocess'], default='syscall')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for the socket and volumes')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('--baseline', type=str, help='Compare against results JSON from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression vs. baseline')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Per-RPC INFO logs would dominate what is being measured
+    logging.basicConfig(level=logging.WARNING)
+    results = run(args)
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
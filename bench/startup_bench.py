@@ -0,0 +1,120 @@
+"""Cold-start time and memory of the CSI plugin per --mode.
+
+Launches server.py as a separate process for each mode, polls Probe over
+the Unix socket until it reports ready and then reads the process's
+resident memory from /proc. Each mode is started --runs times with a
+fresh volume root; the table shows the median and worst run.
+
+    python bench/startup_bench.py --runs 5 --output startup.json
+
+Extra arguments after "--" are passed to server.py, e.g.
+"-- --quota simulated".
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+import grpc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from csi import csi_pb2 as pb  # noqa: E402
+from csi import csi_pb2_grpc as pb_grpc  # noqa: E402
+
+MODES = ("node", "controller", "all")
+
+
+def read_status(pid):
+    """VmRSS and VmHWM of `pid` in bytes."""
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(rest.split()[0]) * 1024
+    return values
+
+
+def wait_ready(endpoint, deadline):
+    channel = grpc.insecure_channel(endpoint)
+    stub = pb_grpc.IdentityStub(channel)
+    try:
+        while time.monotonic() < deadline:
+            try:
+                if stub.Probe(pb.ProbeRequest(), timeout=0.5).ready.value:
+                    return True
+            except grpc.RpcError:
+                pass
+            time.sleep(0.005)
+        return False
+    finally:
+        channel.close()
+
+
+def start_once(mode, extra, timeout):
+    workdir = tempfile.mkdtemp(prefix="csi-startup-")
+    endpoint = f"unix://{workdir}/csi.sock"
+    command = [sys.executable, os.path.join(ROOT, "server.py"), "--drivername", "bench.csi",
+               "--endpoint", endpoint, "--nodeid", "bench-node", "--volume-root", os.path.join(workdir, "volumes"),
+               "--mode", mode] + extra
+    started = time.monotonic()
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(endpoint, started + timeout):
+            raise RuntimeError(f"--mode {mode} did not become ready within {timeout}s")
+        ready = time.monotonic() - started
+        memory = read_status(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"ready_seconds": ready, "rss_bytes": memory.get("VmRSS", 0), "peak_rss_bytes": memory.get("VmHWM", 0)}
+
+
+def summarize(samples):
+    result = {}
+    for key in samples[0]:
+        values = [s[key] for s in samples]
+        result[key] = {"median": statistics.median(values), "max": max(values)}
+    return result
+
+
+def print_table(results):
+    print(f"{'mode':<12}{'ready p50':>12}{'ready max':>12}{'RSS p50':>12}{'peak RSS':>12}")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['ready_seconds']['median'] * 1000:>10.0f}ms{r['ready_seconds']['max'] * 1000:>10.0f}ms"
+              f"{r['rss_bytes']['median'] / 2**20:>10.1f}MB{r['peak_rss_bytes']['max'] / 2**20:>10.1f}MB")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='CSI plugin cold-start benchmark')
+    parser.add_argument('--modes', type=lambda s: s.split(","), default=list(MODES),
+                        help='Comma separated --mode values to measure')
+    parser.add_argument('--runs', type=int, default=5, help='Starts per mode')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Seconds to wait for Probe to report ready')
+    parser.add_argument('--output', type=str, help='Write results as JSON to this file')
+    parser.add_argument('server_args', nargs=argparse.REMAINDER, help='Arguments for server.py after "--"')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    extra = [a for a in args.server_args if a != "--"]
+    results = {}
+    for mode in args.modes:
+        results[mode] = summarize([start_once(mode, extra, args.timeout) for _ in range(args.runs)])
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+import grpc
+from csi.metrics import REGISTRY, Counter, Gauge, _method_name
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+# In-memory RPCs that are never limited: Probe must answer even under overload
+EXEMPT_METHODS = frozenset([
+    "GetPluginInfo",
+    "GetPluginCapabilities",
+    "Probe",
+    "ControllerGetCapabilities",
+    "GroupControllerGetCapabilities",
+    "NodeGetCapabilities",
+    "NodeGetInfo",
+])
+
+ADMISSION_REJECTED = REGISTRY.register(Counter(
+    "csi_admission_rejected_total", "RPCs shed by admission control, by method and reason.", ["method", "reason"]))
+ADMISSION_LIMIT = REGISTRY.register(Gauge(
+    "csi_admission_limit", "Current adaptive concurrency limit, by method.", ["method"]))
+ADMISSION_QUEUED = REGISTRY.register(Gauge(
+    "csi_admission_queued", "RPCs waiting for a concurrency slot, by method.", ["method"]))
+
+
+class Rejected(Exception):
+    def __init__(self, reason, details):
+        super().__init__(details)
+        self.reason = reason
+        self.details = details
+
+
+class AIMDLimit:
+    """Additive-increase/multiplicative-decrease concurrency limit.
+
+    Every call slower than `latency_target` cuts the limit by `backoff`.
+    Calls that finish in time while at least half the limit is in use
+    raise it by 1/limit, so roughly by one per round of `limit` calls.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=64, latency_target=5.0, backoff=0.9):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self._limit = float(initial)
+
+    @property
+    def value(self):
+        return int(self._limit)
+
+    def on_sample(self, latency, inflight):
+        if latency > self.latency_target:
+            self._limit = max(self.minimum, self._limit * self.backoff)
+        elif inflight * 2 >= self._limit:
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+
+
+class MethodGate:
+    """Concurrency slots, bounded wait queue and service time estimate of one RPC method."""
+
+    def __init__(self, method, limit, queue_depth):
+        self.method = method
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.inflight = 0
+        self.waiting = 0
+        self.service_time = 0.0  # EWMA of observed latency, seconds
+        self._cond = threading.Condition()
+        self._async_waiters = deque()  # (loop, future) of acquire_async callers, oldest first
+        ADMISSION_LIMIT.set(limit.value, method)
+
+    def _check_deadline(self, time_remaining):
+        if time_remaining is not None and time_remaining < self.service_time:
+            raise Rejected("deadline", f"{self.method} needs ~{self.service_time:.3f}s, "
+                                       f"only {max(time_remaining, 0):.3f}s left before the deadline")
+
+    def acquire(self, time_remaining=None):
+        """Take a slot, waiting in the queue if none is free."""
+        with self._cond:
+            self._check_deadline(time_remaining)
+            if self.inflight < self.limit.value:
+                self.inflight += 1
+                return True
+            if self.waiting >= self.queue_depth:
+                raise Rejected("queue_full", f"{self.method}: {self.inflight} running and "
+                                             f"{self.waiting} queued, limit {self.limit.value}")
+            # Only worth waiting while the call can still finish in time
+            deadline = None
+            if time_remaining is not None:
+                deadline = time.monotonic() + time_remaining - self.service_time
+            self.waiting += 1
+            ADMISSION_QUEUED.inc(self.method)
+            try:
+                while self.inflight >= self.limit.value:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise Rejected("deadline", f"{self.method} would not finish before its deadline")
+                    self._cond.wait(timeout)
+            finally:
+                self.waiting -= 1
+                ADMISSION_QUEUED.dec(self.method)
+            self.inflight += 1
+            return True
+
+    async def acquire_async(self, time_remaining=None):
+        """acquire() for grpc.aio: a queued caller waits on a future of its event loop, not a thread."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            self._check_deadline(time_remaining)
+            if self.inflight < self.limit.value:
+                self.inflight += 1
+                return
+            if self.waiting >= self.queue_depth:
+                raise Rejected("queue_full", f"{self.method}: {self.inflight} running and "
+                                             f"{self.waiting} queued, limit {self.limit.value}")
+            waiter = (loop, loop.create_future())
+            self._async_waiters.append(waiter)
+            self.waiting += 1
+            ADMISSION_QUEUED.inc(self.method)
+        timeout = None if time_remaining is None else max(0.0, time_remaining - self.service_time)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                if waiter in self._async_waiters:
+                    self._async_waiters.remove(waiter)
+                    self.waiting -= 1
+                    ADMISSION_QUEUED.dec(self.method)
+                else:
+                    # Granted a slot just as we gave up; hand it to the next caller
+                    self.inflight -= 1
+                    self._wake()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Rejected("deadline", f"{self.method} would not finish before its deadline") from None
+            raise
+
+    def _wake(self):
+        """Pass free slots to queued async callers, then let blocked threads recheck. Needs _cond held."""
+        while self._async_waiters and self.inflight < self.limit.value:
+            loop, future = self._async_waiters.popleft()
+            self.inflight += 1
+            self.waiting -= 1
+            ADMISSION_QUEUED.dec(self.method)
+            loop.call_soon_threadsafe(_grant, future)
+        self._cond.notify_all()
+
+    def release(self, latency):
+        with self._cond:
+            self.limit.on_sample(latency, self.inflight)
+            self.inflight -= 1
+            self.service_time = latency if not self.service_time else 0.8 * self.service_time + 0.2 * latency
+            ADMISSION_LIMIT.set(self.limit.value, self.method)
+            self._wake()
+
+
+def _grant(future):
+    # Cancelled futures are handled by acquire_async, which then gives the slot back
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionControl:
+    """Per-method admission control and load shedding for the CSI servers.
+
+    Each method gets an AIMD concurrency limit (`limits` overrides the
+    default per method with (limit, queue depth)) and a bounded queue of
+    callers waiting for a slot. A call is answered RESOURCE_EXHAUSTED
+    straight away when the queue is full, or when its remaining deadline
+    is shorter than the method's observed service time, instead of being
+    worked on after the client has already given up. EXEMPT_METHODS are
+    never limited.
+    """
+
+    def __init__(self, concurrency=8, queue_depth=32, limits=None, max_concurrency=64, latency_target=5.0):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.limits = dict(limits or {})
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self._lock = threading.Lock()
+        self._gates = {}
+
+    def gate(self, method):
+        if method in EXEMPT_METHODS:
+            return None
+        with self._lock:
+            gate = self._gates.get(method)
+            if gate is None:
+                limit, queue_depth = self.limits.get(method, (self.concurrency, None))
+                if limit <= 0:
+                    return None
+                if queue_depth is None:
+                    queue_depth = self.queue_depth
+                gate = MethodGate(method, AIMDLimit(limit, maximum=self.max_concurrency,
+                                                    latency_target=self.latency_target), queue_depth)
+                self._gates[method] = gate
+            return gate
+
+    def stats(self):
+        with self._lock:
+            gates = list(self._gates.values())
+        return {g.method: {"limit": g.limit.value, "inflight": g.inflight, "waiting": g.waiting,
+                           "service_time": g.service_time} for g in gates}
+
+
+def parse_limit(text):
+    """Parse "Method=LIMIT[:QUEUE]" into (method, (limit, queue depth or None))."""
+    method, sep, value = text.partition("=")
+    limit, _, queue = value.partition(":")
+    if not sep or not method:
+        raise ValueError(f"invalid admission limit {text!r}, expected Method=LIMIT[:QUEUE]")
+    return method, (int(limit), int(queue) if queue else None)
+
+
+def _reject(method, e):
+    ADMISSION_REJECTED.inc(method, e.reason)
+    logger.log(V(2), "Rejected %s: %s", method, e.details)
+
+
+class AdmissionInterceptor(grpc.ServerInterceptor):
+    """Applies AdmissionControl to the unary RPCs of a grpc.server."""
+
+    def __init__(self, admission):
+        self.admission = admission
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        method = _method_name(handler_call_details)
+        gate = self.admission.gate(method)
+        if gate is None:
+            return handler
+        behavior = handler.unary_unary
+
+        def admitted(request, context):
+            try:
+                gate.acquire(context.time_remaining())
+            except Rejected as e:
+                _reject(method, e)
+                context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, e.details)
+            start = time.perf_counter()
+            try:
+                return behavior(request, context)
+            finally:
+                gate.release(time.perf_counter() - start)
+
+        return grpc.unary_unary_rpc_method_handler(
+            admitted,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class AsyncAdmissionInterceptor(grpc.aio.ServerInterceptor):
+    """AdmissionInterceptor for grpc.aio servers.
+
+    Calls that have to queue wait on the event loop in their method's
+    gate (MethodGate.acquire_async), so no thread is tied up by them and
+    every waiter counts against that method's queue depth.
+    """
+
+    def __init__(self, admission):
+        self.admission = admission
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        method = _method_name(handler_call_details)
+        gate = self.admission.gate(method)
+        if gate is None:
+            return handler
+        behavior = handler.unary_unary
+
+        async def admitted(request, context):
+            try:
+                await gate.acquire_async(context.time_remaining())
+            except Rejected as e:
+                _reject(method, e)
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, e.details)
+            start = time.perf_counter()
+            try:
+                return await behavior(request, context)
+            finally:
+                gate.release(time.perf_counter() - start)
+
+        return grpc.unary_unary_rpc_method_handler(
+            admitted,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
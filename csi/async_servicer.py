@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from csi.call_context import AbortedCall, CapturingContext
+
+logger = logging.getLogger('CSIPlugin')
+
+# RPCs that only touch in-memory state are answered
+# directly on the event loop; everything else runs on the blocking executor.
+INLINE_METHODS = frozenset([
+    "GetPluginInfo",
+    "GetPluginCapabilities",
+    "Probe",
+    "ControllerGetCapabilities",
+    "GroupControllerGetCapabilities",
+    "ControllerPublishVolume",
+    "ControllerUnpublishVolume",
+    "NodeGetCapabilities",
+    "NodeGetInfo",
+])
+
+# Server-streaming RPCs: the servicer method is a generator, advanced one
+# response at a time on the blocking executor.
+STREAMING_METHODS = frozenset([
+    "GetMetadataAllocated",
+    "GetMetadataDelta",
+])
+
+_DONE = object()
+
+
+def _rpc_names(base_cls):
+    return [name for name, attr in vars(base_cls).items()
+            if not name.startswith("_") and callable(attr)]
+
+
+def make_async_servicer(servicer, base_cls, executor, inline_methods=INLINE_METHODS):
+    """Wrap a synchronous servicer so it can be registered on a grpc.aio server.
+
+    `base_cls` is the generated servicer class (e.g. ControllerServicer);
+    every RPC it declares becomes a coroutine that either calls `servicer`
+    inline or hands it to `executor`. The servicer sees a CapturingContext,
+    and the recorded status is replayed on the asyncio context afterwards.
+    With `executor` None every unary RPC is called inline.
+    """
+
+    def make_handler(name):
+        method = getattr(servicer, name)
+        inline = executor is None or name in inline_methods
+
+        async def handler(self, request, context):
+            shim = CapturingContext(context)
+            try:
+                if inline:
+                    response = method(request, shim)
+                else:
+                    loop = asyncio.get_running_loop()
+                    response = await loop.run_in_executor(executor, method, request, shim)
+            except AbortedCall as e:
+                await context.abort(e.code, e.details)
+            except Exception:
+                # e.g. the generated UNIMPLEMENTED stubs set a code and then raise
+                if shim.code() is not None:
+                    await context.abort(shim.code(), shim.details() or "")
+                raise
+            shim.apply(context)
+            return response
+
+        async def stream_handler(self, request, context):
+            shim = CapturingContext(context)
+            loop = asyncio.get_running_loop()
+            responses = method(request, shim)
+            try:
+                while True:
+                    response = await loop.run_in_executor(executor, next, responses, _DONE)
+                    if response is _DONE:
+                        break
+                    yield response
+            except AbortedCall as e:
+                await context.abort(e.code, e.details)
+            finally:
+                responses.close()
+            shim.apply(context)
+
+        if name in STREAMING_METHODS:
+            stream_handler.__name__ = name
+            return stream_handler
+        handler.__name__ = name
+        return handler
+
+    namespace = {name: make_handler(name) for name in _rpc_names(base_cls)}
+    return type(f"Async{type(servicer).__name__}", (base_cls,), namespace)()
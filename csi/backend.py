@@ -0,0 +1,532 @@
+import os
+import stat
+import time
+import errno
+import ctypes
+import ctypes.util
+import shutil
+import logging
+import threading
+import itertools
+import collections
+from csi.mounter import MountError, new_mounter
+from csi.mount_table import MountTable
+
+logger = logging.getLogger('CSIPlugin')
+
+# The filesystem and mount operations the services perform on the host. A
+# backend bundles them so the same service code runs against the real
+# host (OSBackend) or against an in-memory model (FakeBackend) that needs
+# neither root nor real mounts and costs next to nothing per call.
+#
+#   exists(path), isdir(path), isfile(path), makedirs(path, exist_ok=True), rmdir(path), unlink(path)
+#   rename(src, dst), truncate(path, size), listdir(path), scandir(path), stat(path), statvfs(path)
+#   rmtree(path), remove_tree(path, on_removed=None) -> bytes freed, syncfs(path)
+#   copy_tree(src, dst) -> CopyStats, allocated_extents(path, offset=0),
+#   load_block_index(index_path, image_path) -> BlockIndex
+#   bind_mount(source, target), mount(source, target, fstype), unmount(target),
+#   ismount(target), mount_source(target)
+
+
+class OSBackend:
+    """The real host: os/shutil for the filesystem, a mounter plus the mount table for mounts."""
+
+    name = "os"
+
+    def __init__(self, mounter=None, mount_table=None, copy_workers=4):
+        self.mounter = mounter or new_mounter()
+        self._mount_table = mount_table
+        self._copy_workers = copy_workers
+        self._copier = None
+        self._lock = threading.Lock()
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._syncfs = libc.syncfs
+            self._syncfs.argtypes = [ctypes.c_int]
+        except (OSError, AttributeError):
+            self._syncfs = None
+
+    @property
+    def mount_table(self):
+        # Only the node side needs it, so the watcher thread starts on first use
+        if self._mount_table is None:
+            with self._lock:
+                if self._mount_table is None:
+                    self._mount_table = MountTable()
+        return self._mount_table
+
+    @property
+    def copier(self):
+        # Only snapshots and clones copy, so the node side never starts the pool
+        # nor imports the copy engine
+        if self._copier is None:
+            with self._lock:
+                if self._copier is None:
+                    from csi.copy_engine import CopyEngine
+                    self._copier = CopyEngine(self._copy_workers)
+        return self._copier
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def makedirs(self, path, exist_ok=True):
+        os.makedirs(path, exist_ok=exist_ok)
+
+    def rmdir(self, path):
+        os.rmdir(path)
+
+    def unlink(self, path):
+        os.unlink(path)
+
+    def truncate(self, path, size):
+        """Create `path` if missing and set its size; growing leaves a hole."""
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+
+    def rename(self, src, dst):
+        os.rename(src, dst)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def scandir(self, path):
+        with os.scandir(path) as it:
+            yield from it
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def statvfs(self, path):
+        return os.statvfs(path)
+
+    def rmtree(self, path):
+        shutil.rmtree(path)
+
+    def syncfs(self, path):
+        """Write back the whole filesystem containing `path`."""
+        if self._syncfs is None:
+            os.sync()
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if self._syncfs(fd) != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err), path)
+        finally:
+            os.close(fd)
+
+    def copy_tree(self, src, dst):
+        """Copy the contents of directory `src` into `dst` with the CopyEngine."""
+        return self.copier.copy_tree(src, dst)
+
+    def allocated_extents(self, path, offset=0):
+        """(offset, length) of the allocated ranges of an image file, as a list."""
+        from csi.image import allocated_extents
+        return list(allocated_extents(path, offset))
+
+    def load_block_index(self, index_path, image_path):
+        from csi.image import BlockIndex
+        return BlockIndex.load_or_build(index_path, image_path)
+
+    def remove_tree(self, path, on_removed=None):
+        """Remove `path` entry by entry, calling on_removed(size) after each one.
+
+        Unlike rmtree this lets the caller pace the removal; returns the
+        number of bytes freed.
+        """
+        reclaimed = 0
+
+        def removed(size):
+            nonlocal reclaimed
+            reclaimed += size
+            if on_removed is not None:
+                on_removed(size)
+
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirnames, filenames in os.walk(path, topdown=False):
+                for filename in filenames:
+                    removed(self._unlink(os.path.join(dirpath, filename)))
+                for dirname in dirnames:
+                    self._remove_dir(os.path.join(dirpath, dirname))
+                    removed(0)
+            self._remove_dir(path)
+            removed(0)
+        else:
+            removed(self._unlink(path))
+        return reclaimed
+
+    @staticmethod
+    def _unlink(path):
+        size = os.lstat(path).st_size
+        os.unlink(path)
+        return size
+
+    @staticmethod
+    def _remove_dir(path):
+        try:
+            os.rmdir(path)
+        except NotADirectoryError:
+            # os.walk lists symlinks to directories under dirnames
+            os.unlink(path)
+
+    def bind_mount(self, source, target):
+        self.mounter.bind_mount(source, target)
+        self.mount_table.note_mounted(target, source)
+
+    def mount(self, source, target, fstype):
+        self.mounter.mount(source, target, fstype)
+        self.mount_table.note_mounted(target, source)
+
+    def unmount(self, target):
+        self.mounter.unmount(target)
+        self.mount_table.note_unmounted(target)
+
+    def ismount(self, target):
+        return self.mount_table.is_mounted(target)
+
+    def mount_source(self, target):
+        entry = self.mount_table.get(target)
+        return entry.source if entry is not None else None
+
+
+class _Node:
+    __slots__ = ("ino", "children", "size", "ctime")
+
+    def __init__(self, ino, size=None):
+        self.ino = ino
+        # Directories have children, files only a size
+        self.children = {} if size is None else None
+        self.size = size or 0
+        self.ctime = time.time()
+
+
+class _FakeDirEntry:
+    """The subset of os.DirEntry used by the services."""
+
+    def __init__(self, backend, parent, name):
+        self.name = name
+        self.path = os.path.join(parent, name)
+        self._backend = backend
+
+    def is_dir(self, follow_symlinks=True):
+        return self._backend.isdir(self.path)
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        return self._backend.stat(self.path)
+
+
+class FakeBackend:
+    """In-memory directory tree and mount table.
+
+    Directories and (data-less) files are modelled. Errors mirror the
+    errno the kernel would report, and statvfs returns a fixed
+    filesystem of `total_bytes`, so hundreds of thousands of volumes can be
+    created, published and deleted on any machine without touching disk.
+    """
+
+    name = "fake"
+
+    BLOCK_SIZE = 4096
+
+    def __init__(self, total_bytes=1 << 40, free_bytes=None, files=1 << 24):
+        self.total_bytes = total_bytes
+        self.free_bytes = total_bytes if free_bytes is None else free_bytes
+        self.files = files
+        self._lock = threading.Lock()
+        self._inodes = itertools.count(1)
+        self._root = _Node(next(self._inodes))
+        self._mounts = {}  # target -> source
+
+    @staticmethod
+    def _split(path):
+        return [part for part in os.path.normpath(path).split("/") if part]
+
+    def _lookup(self, path):
+        node = self._root
+        for part in self._split(path):
+            if node.children is None:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            node = node.children.get(part)
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        return node
+
+    def _parent(self, path):
+        parts = self._split(path)
+        if not parts:
+            raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), path)
+        return self._lookup("/" + "/".join(parts[:-1])), parts[-1]
+
+    def _busy(self, path):
+        prefix = os.path.normpath(path)
+        return any(t == prefix or t.startswith(prefix + "/") for t in self._mounts)
+
+    def exists(self, path):
+        with self._lock:
+            try:
+                self._lookup(path)
+                return True
+            except FileNotFoundError:
+                return False
+
+    def isdir(self, path):
+        with self._lock:
+            try:
+                return self._lookup(path).children is not None
+            except OSError:
+                return False
+
+    def isfile(self, path):
+        with self._lock:
+            try:
+                return self._lookup(path).children is None
+            except OSError:
+                return False
+
+    def makedirs(self, path, exist_ok=True):
+        with self._lock:
+            node = self._root
+            created = False
+            for part in self._split(path):
+                if node.children is None:
+                    raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+                child = node.children.get(part)
+                if child is None:
+                    child = node.children[part] = _Node(next(self._inodes))
+                    created = True
+                node = child
+            if not created and not exist_ok:
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+
+    def rmdir(self, path):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            if node.children is None:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            if node.children:
+                raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), path)
+            if os.path.normpath(path) in self._mounts:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), path)
+            del parent.children[name]
+
+    def unlink(self, path):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            if node.children is not None:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+            if os.path.normpath(path) in self._mounts:
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), path)
+            del parent.children[name]
+
+    def truncate(self, path, size):
+        with self._lock:
+            parent, name = self._parent(path)
+            node = parent.children.get(name)
+            if node is None:
+                node = parent.children[name] = _Node(next(self._inodes), size=0)
+            if node.children is not None:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+            node.size = size
+
+    def rename(self, src, dst):
+        with self._lock:
+            src_parent, src_name = self._parent(src)
+            node = src_parent.children.get(src_name)
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+            if self._busy(src):
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), src)
+            dst_parent, dst_name = self._parent(dst)
+            existing = dst_parent.children.get(dst_name)
+            if existing is not None and existing is not node and existing.children is not None \
+                    and existing.children:
+                raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), dst)
+            del src_parent.children[src_name]
+            dst_parent.children[dst_name] = node
+
+    def listdir(self, path):
+        with self._lock:
+            node = self._lookup(path)
+            if node.children is None:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            return list(node.children)
+
+    def scandir(self, path):
+        return [_FakeDirEntry(self, path, name) for name in self.listdir(path)]
+
+    def stat(self, path):
+        with self._lock:
+            node = self._lookup(path)
+        mtime = int(node.ctime)
+        if node.children is None:
+            # Data-less files occupy no blocks, like a sparse file
+            return os.stat_result((stat.S_IFREG | 0o600, node.ino, 1, 1, 0, 0, node.size, mtime, mtime, mtime),
+                                  {"st_blocks": 0, "st_mtime_ns": int(node.ctime * 1e9)})
+        return os.stat_result((stat.S_IFDIR | 0o755, node.ino, 1, 2 + len(node.children),
+                               0, 0, self.BLOCK_SIZE, mtime, mtime, mtime),
+                              {"st_blocks": self.BLOCK_SIZE // 512, "st_mtime_ns": int(node.ctime * 1e9)})
+
+    def statvfs(self, path):
+        with self._lock:
+            self._lookup(path)
+        blocks = self.total_bytes // self.BLOCK_SIZE
+        free = self.free_bytes // self.BLOCK_SIZE
+        return os.statvfs_result((self.BLOCK_SIZE, self.BLOCK_SIZE, blocks, free, free,
+                                  self.files, self.files, self.files, 0, 255))
+
+    def rmtree(self, path):
+        self.remove_tree(path)
+
+    def syncfs(self, path):
+        with self._lock:
+            self._lookup(path)
+
+    def copy_tree(self, src, dst):
+        from csi.copy_engine import CopyStats
+        self.makedirs(dst, exist_ok=True)
+        files = nbytes = 0
+        with self._lock:
+            source = self._lookup(src)
+            if source.children is None:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), src)
+            stack = [(source, self._lookup(dst))]
+            while stack:
+                src_node, dst_node = stack.pop()
+                for name, child in src_node.children.items():
+                    if child.children is None:
+                        dst_node.children[name] = _Node(next(self._inodes), size=child.size)
+                        files += 1
+                        nbytes += child.size
+                    else:
+                        copy = dst_node.children[name] = _Node(next(self._inodes))
+                        stack.append((child, copy))
+        return CopyStats(files, nbytes, 0, 0)
+
+    def allocated_extents(self, path, offset=0):
+        # Files carry no data, so images are entirely holes
+        self.stat(path)
+        return []
+
+    def load_block_index(self, index_path, image_path):
+        from csi.image import BlockIndex, HOLE, INDEX_BLOCK_SIZE
+        size = self.stat(image_path).st_size
+        return BlockIndex(INDEX_BLOCK_SIZE, size, HOLE * ((size + INDEX_BLOCK_SIZE - 1) // INDEX_BLOCK_SIZE))
+
+    def remove_tree(self, path, on_removed=None):
+        with self._lock:
+            if self._busy(path):
+                raise OSError(errno.EBUSY, os.strerror(errno.EBUSY), path)
+            parent, name = self._parent(path)
+            node = parent.children.pop(name, None)
+            if node is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        if on_removed is not None:
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                if current.children is not None:
+                    stack.extend(current.children.values())
+                on_removed(current.size)
+        return node.size if node.children is None else 0
+
+    def bind_mount(self, source, target):
+        with self._lock:
+            for path in (source, target):
+                try:
+                    self._lookup(path)
+                except FileNotFoundError:
+                    raise MountError(f"mount --bind {source} {target} failed: "
+                                     f"{os.strerror(errno.ENOENT)}", errno.ENOENT)
+            self._mounts[os.path.normpath(target)] = source
+
+    def mount(self, source, target, fstype):
+        self.bind_mount(source, target)
+
+    def unmount(self, target):
+        with self._lock:
+            if self._mounts.pop(os.path.normpath(target), None) is None:
+                raise MountError(f"umount {target} failed: {os.strerror(errno.EINVAL)}", errno.EINVAL)
+
+    def ismount(self, target):
+        return os.path.normpath(target) in self._mounts
+
+    def mount_source(self, target):
+        return self._mounts.get(os.path.normpath(target))
+
+
+class RecordingBackend:
+    """Wraps another backend and records every call it forwards.
+
+    `calls` keeps the most recent (operation, args, seconds, error) tuples,
+    `summary()` the per-operation count, error count and total time, which
+    shows how much of an RPC is spent in the backend versus the plugin.
+    """
+
+    def __init__(self, inner, limit=10000):
+        self.inner = inner
+        self.name = f"recording({inner.name})"
+        self._lock = threading.Lock()
+        self.calls = collections.deque(maxlen=limit)
+        self._totals = {}  # operation -> [count, errors, seconds]
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        def recorded(*args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                return attr(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                self._record(name, args, time.perf_counter() - start, error)
+
+        return recorded
+
+    def _record(self, operation, args, seconds, error):
+        with self._lock:
+            self.calls.append((operation, args, seconds, error))
+            totals = self._totals.setdefault(operation, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += error is not None
+            totals[2] += seconds
+
+    def summary(self):
+        with self._lock:
+            return {op: {"count": n, "errors": errors, "seconds": seconds}
+                    for op, (n, errors, seconds) in sorted(self._totals.items())}
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self._totals.clear()
+
+
+def new_backend(kind="os", mounter="syscall", copy_workers=4):
+    if kind == "fake":
+        return FakeBackend()
+    if kind == "recording":
+        return RecordingBackend(OSBackend(new_mounter(mounter), copy_workers=copy_workers))
+    return OSBackend(new_mounter(mounter), copy_workers=copy_workers)
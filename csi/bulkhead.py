@@ -0,0 +1,135 @@
+import logging
+import threading
+from concurrent import futures
+import grpc
+from csi.admission import EXEMPT_METHODS
+from csi.call_context import AbortedCall
+from csi.metrics import REGISTRY, Counter, Gauge, _method_name
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+# gRPC service -> class of work it does; each class gets its own executor
+SERVICE_CLASSES = {
+    "csi.v1.Identity": "identity",
+    "csi.v1.Controller": "controller",
+    "csi.v1.GroupController": "controller",
+    "csi.v1.SnapshotMetadata": "controller",
+    "csi.v1.Node": "node",
+}
+
+BULKHEAD_PENDING = REGISTRY.register(Gauge(
+    "csi_bulkhead_pending", "RPCs running or queued on a service class executor.", ["service"]))
+BULKHEAD_REJECTED = REGISTRY.register(Counter(
+    "csi_bulkhead_rejected_total", "RPCs rejected because their service class executor was full.", ["service"]))
+
+
+def service_class(service):
+    """Class of a fully qualified service name ("csi.v1.Node") or generated servicer class name ("NodeServicer")."""
+    if service.endswith("Servicer"):
+        service = "csi.v1." + service[:-len("Servicer")]
+    return SERVICE_CLASSES.get(service)
+
+
+class Bulkhead(futures.ThreadPoolExecutor):
+    """Thread pool of one service class with a bounded backlog.
+
+    Once `workers + queue_depth` calls are running or queued, submit raises
+    AbortedCall(RESOURCE_EXHAUSTED), so one class cannot take up all of the
+    server's --max-concurrent-rpcs slots. queue_depth 0 means unbounded.
+    """
+
+    def __init__(self, name, workers, queue_depth=0):
+        super().__init__(max_workers=workers, thread_name_prefix=f"csi-{name}")
+        self.name = name
+        self.capacity = workers + queue_depth if queue_depth > 0 else None
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._pending_lock:
+            if self.capacity is not None and self.pending >= self.capacity:
+                BULKHEAD_REJECTED.inc(self.name)
+                logger.log(V(2), "Rejected %s call: %s already running or queued", self.name, self.pending)
+                raise AbortedCall(grpc.StatusCode.RESOURCE_EXHAUSTED,
+                                  f"too many {self.name} calls in progress ({self.pending})")
+            self.pending += 1
+        BULKHEAD_PENDING.inc(self.name)
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _):
+        with self._pending_lock:
+            self.pending -= 1
+        BULKHEAD_PENDING.dec(self.name)
+
+
+class Bulkheads:
+    """One Bulkhead per service class, sized independently.
+
+    A backlog of slow DeleteVolume rmtrees can only exhaust the controller
+    pool and hung mounts only the node pool, so Identity calls never wait
+    behind either. A class sized 0 has no executor and runs inline.
+    """
+
+    def __init__(self, sizes, queue_depth=0):
+        self.executors = {name: Bulkhead(name, workers, queue_depth)
+                          for name, workers in sizes.items() if workers > 0}
+
+    def executor(self, service):
+        return self.executors.get(service_class(service))
+
+    def capacity(self):
+        """Calls all bulkheads together may hold, or None if any of them is unbounded."""
+        capacities = [e.capacity for e in self.executors.values()]
+        return None if None in capacities else sum(capacities)
+
+    def stats(self):
+        return {name: e.pending for name, e in self.executors.items()}
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+
+class BulkheadInterceptor(grpc.ServerInterceptor):
+    """Runs each unary RPC of a grpc.server on the Bulkhead of its service class.
+
+    Must come last among the interceptors. The server's own thread pool
+    then only receives calls and waits on the bulkheads, so it is sized
+    for concurrent RPCs rather than for work. EXEMPT_METHODS stay on the
+    server thread.
+    """
+
+    def __init__(self, bulkheads):
+        self.bulkheads = bulkheads
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        if _method_name(handler_call_details) in EXEMPT_METHODS:
+            return handler
+        service = handler_call_details.method.lstrip("/").split("/", 1)[0]
+        executor = self.bulkheads.executor(service)
+        if executor is None:
+            return handler
+        behavior = handler.unary_unary
+
+        def isolated(request, context):
+            try:
+                future = executor.submit(behavior, request, context)
+            except AbortedCall as e:
+                context.abort(e.code, e.details)
+            return future.result()
+
+        return grpc.unary_unary_rpc_method_handler(
+            isolated,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
@@ -0,0 +1,64 @@
+import grpc
+
+
+class AbortedCall(Exception):
+    """Raised by CapturingContext.abort in place of the real gRPC abort."""
+
+    def __init__(self, code, details):
+        super().__init__(f"{code}: {details}")
+        self.code = code
+        self.details = details
+
+
+class CapturingContext:
+    """Stand-in for a grpc.ServicerContext that records the call status.
+
+    Servicer methods write their status (set_code/set_details/abort) into
+    this object instead of the live context, so the outcome can be replayed
+    later: onto an asyncio context from a worker thread, or onto several
+    callers that share one result. Everything else is read from the wrapped
+    context, if any.
+    """
+
+    def __init__(self, context=None):
+        self._context = context
+        self._code = None
+        self._details = None
+
+    def __getattr__(self, name):
+        if self._context is None:
+            raise AttributeError(name)
+        return getattr(self._context, name)
+
+    def set_code(self, code):
+        self._code = code
+
+    def set_details(self, details):
+        self._details = details
+
+    def code(self):
+        return self._code
+
+    def details(self):
+        return self._details
+
+    def abort(self, code, details=""):
+        self._code = code
+        self._details = details
+        raise AbortedCall(code, details)
+
+    def time_remaining(self):
+        if self._context is None:
+            return None
+        return self._context.time_remaining()
+
+    def apply(self, context):
+        """Copy the recorded status onto a synchronous context."""
+        if self._code is not None:
+            context.set_code(self._code)
+        if self._details is not None:
+            context.set_details(self._details)
+
+    def abort_on(self, context):
+        """Replay a recorded abort on a synchronous context (raises)."""
+        context.abort(self._code or grpc.StatusCode.UNKNOWN, self._details or "")
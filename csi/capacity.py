@@ -0,0 +1,60 @@
+import logging
+import threading
+from csi.backend import OSBackend
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+
+class CapacityModel:
+    """Cached free-space model of VOLUME_ROOT used to answer GetCapacity.
+
+    statvfs of the volume root is sampled by a background thread every
+    `interval` seconds. Volumes are thick-provisioned: the capacity each
+    volume requested counts as reserved, so the space offered for new
+    volumes is the free space, capped by whatever the existing
+    reservations still leave of the filesystem. Readers never touch disk.
+    """
+
+    def __init__(self, volume_root, reserved_bytes=0, interval=30.0, min_volume_size=0, backend=None):
+        self.volume_root = volume_root
+        self.backend = backend or OSBackend()
+        self.interval = interval
+        self.min_volume_size = min_volume_size
+        self._lock = threading.Lock()
+        self._reserved = reserved_bytes
+        self._total = 0
+        self._free = 0
+        self._stop = threading.Event()
+        self.refresh()
+        threading.Thread(target=self._run, name="capacity-refresh", daemon=True).start()
+
+    def refresh(self):
+        try:
+            with timed("statvfs"):
+                stat = self.backend.statvfs(self.volume_root)
+        except OSError as e:
+            logger.error("Failed to statvfs %s: %s", self.volume_root, e)
+            return
+        with self._lock:
+            self._total = stat.f_blocks * stat.f_frsize
+            self._free = stat.f_bavail * stat.f_frsize
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+    def stop(self):
+        self._stop.set()
+
+    def reserve(self, nbytes):
+        with self._lock:
+            self._reserved += nbytes
+
+    def release(self, nbytes):
+        with self._lock:
+            self._reserved = max(0, self._reserved - nbytes)
+
+    def available(self):
+        with self._lock:
+            return max(0, min(self._free, self._total - self._reserved))
@@ -1,7 +1,12 @@
 import os
-import shutil
+import json
+import base64
 import logging
+import binascii
+import threading
+from concurrent import futures
 import grpc
+from google.protobuf.timestamp_pb2 import Timestamp
 from csi.csi_pb2 import (
     CreateVolumeResponse,
     DeleteVolumeResponse,
@@ -16,35 +21,158 @@ from csi.csi_pb2 import (
     ValidateVolumeCapabilitiesResponse,
     ControllerServiceCapability,
     ControllerGetVolumeRequest,
-    ControllerGetCapabilitiesResponse
+    ControllerGetCapabilitiesResponse,
+    GetCapacityResponse,
+    ControllerExpandVolumeResponse,
+    CreateSnapshotResponse,
+    DeleteSnapshotResponse,
+    ListSnapshotsResponse,
+    Snapshot
 )
 from csi.csi_pb2_grpc import ControllerServicer
+from csi.backend import OSBackend
+from csi.volume_catalog import VolumeCatalog
+from csi.volume_stats import FilesystemStatsCache
+from csi.reaper import TrashReaper
+from csi.capacity import CapacityModel
+from csi.image import IMAGE_FILE, DEFAULT_IMAGE_SIZE, is_image_volume
+from csi.quota import QuotaError
+from csi.oplock import OperationLocks, SingleFlight
+from csi.call_context import AbortedCall, CapturingContext
+from csi.metrics import timed
+from csi.log import V
 
 logger = logging.getLogger('CSIPlugin')
 
+SNAPSHOT_DIR = ".snapshots"
+# Clones are copied here and renamed into place once complete
+CLONE_DIR = ".clones"
+# Block indexes of image-backed snapshots, see SnapshotMetadataService
+INDEX_DIR = ".index"
+
+def encode_list_token(generation, last_volume_id):
+    payload = json.dumps({"g": generation, "k": last_volume_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_list_token(token):
+    """Return (generation, last_volume_id), raising ValueError on malformed tokens."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return int(payload["g"]), str(payload["k"])
+    except (binascii.Error, UnicodeDecodeError, TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"invalid starting_token {token!r}") from e
+
+
 class ControllerService(ControllerServicer):
-    def __init__(self, volume_root="/mnt/hostpath"):
+    def __init__(self, volume_root="/mnt/hostpath", catalog=None, stats_ttl=10.0, reaper=None,
+                 capacity_refresh=30.0, quota=None, backend=None, snapshot_wait=1.0,
+                 warm_pool=None):
         self.VOLUME_ROOT = volume_root
+        self.backend = backend or OSBackend()
+        self.catalog = catalog or VolumeCatalog(volume_root, backend=self.backend)
+        self.fs_stats = FilesystemStatsCache(ttl=stats_ttl, backend=self.backend, root=volume_root)
+        self.reaper = (reaper or TrashReaper(volume_root, backend=self.backend)).start()
+        self.capacity = CapacityModel(volume_root, reserved_bytes=self.catalog.total_capacity(),
+                                      interval=capacity_refresh, backend=self.backend)
+        self.quota = quota
+        if quota is not None and not quota.persistent:
+            self._restore_quotas()
+        self.op_locks = OperationLocks()
+        self.inflight = SingleFlight()
+        # Snapshot copies run in the background; CreateSnapshot waits at most
+        # snapshot_wait seconds and otherwise reports ready_to_use=false
+        self.snapshot_wait = snapshot_wait
+        self._snapshot_pool = futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="csi-snapshot")
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_jobs = {}  # snapshot_id -> Future of the running copy
+        # Pre-provisioned volumes claimed by CreateVolume (see WarmPool)
+        self.warm_pool = warm_pool
+        # Cleared while the StartupReconciler runs
+        self.ready = threading.Event()
+        self.ready.set()
+
+    @staticmethod
+    def _volume_context(path, parameters):
+        context = {"path": path}
+        if is_image_volume(parameters):
+            context["backing"] = "image"
+            context["image"] = os.path.join(path, IMAGE_FILE)
+        return context
+
+    def snapshot_index_path(self, snapshot_id):
+        return os.path.join(self.VOLUME_ROOT, SNAPSHOT_DIR, INDEX_DIR, snapshot_id)
+
+    def forget_snapshot_index(self, snapshot_id):
+        """Drop the block index of a snapshot that is deleted or about to be recaptured."""
+        try:
+            self.backend.unlink(self.snapshot_index_path(snapshot_id))
+        except FileNotFoundError:
+            pass
+
+    def _restore_quotas(self):
+        records = self.catalog.list(limit=1000)
+        while records:
+            for record in records:
+                if record.project_id is None:
+                    continue
+                try:
+                    self.quota.assign(record.path, record.project_id, record.capacity_bytes)
+                except QuotaError as e:
+                    logger.warning("Failed to restore quota for volume %s: %s", record.volume_id, e)
+            records = self.catalog.list(start_after=records[-1].volume_id, limit=1000)
+
+    def _exclusive(self, operation, volume_id, request, context, handler):
+        """Run handler under the per-volume lock, sharing results between identical requests."""
+        def run():
+            if not self.ready.is_set():
+                raise AbortedCall(grpc.StatusCode.UNAVAILABLE, "Startup reconciliation is still running")
+            if not self.op_locks.try_acquire(volume_id, operation):
+                pending = self.op_locks.holder(volume_id)
+                raise AbortedCall(grpc.StatusCode.ABORTED,
+                                  f"An operation ({pending}) is pending for volume {volume_id}")
+            try:
+                shim = CapturingContext(context)
+                return handler(request, shim), shim
+            finally:
+                self.op_locks.release(volume_id)
+
+        key = (operation, request.SerializeToString(deterministic=True))
+        try:
+            response, shim = self.inflight.do(key, run)
+        except AbortedCall as e:
+            context.abort(e.code, e.details)
+        shim.apply(context)
+        return response
 
     def ControllerGetVolume(self, request: ControllerGetVolumeRequest, context):
-        logger.info(f"ControllerGetVolume called for volume: {request.volume_id}")
+        logger.log(V(4), "ControllerGetVolume called for volume: %s", request.volume_id)
         volume_id = request.volume_id
 
         # 1. 验证卷是否存在
-        vol_path = os.path.join(self.VOLUME_ROOT, volume_id)
-        if not os.path.exists(vol_path):
-            logger.error(f"Volume {volume_id} not found")
+        record = self.catalog.get(volume_id)
+        if record is None:
+            logger.error("Volume %s not found", volume_id)
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details(f"Volume {volume_id} not found")
             return ControllerGetVolumeResponse()
+        vol_path = record.path
 
-        # 2. 获取文件系统统计信息
+        # 2. 获取容量信息：有配额时读取该卷的配额报告，否则使用文件系统统计信息
         try:
-            stat = os.statvfs(vol_path)
-            capacity_bytes = stat.f_blocks * stat.f_frsize  # 总容量
-            used_bytes = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+            usage = None
+            if self.quota is not None and record.project_id is not None:
+                usage = self.quota.usage().get(record.project_id)
+            if usage is not None:
+                capacity_bytes = usage.limit_bytes or record.capacity_bytes
+                used_bytes = usage.used_bytes
+            else:
+                with timed("statvfs"):
+                    stat = self.backend.statvfs(vol_path)
+                capacity_bytes = stat.f_blocks * stat.f_frsize  # 总容量
+                used_bytes = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
         except Exception as e:
-            logger.error(f"Failed to get volume stats for {volume_id}: {str(e)}")
+            logger.error("Failed to get volume stats for %s: %s", volume_id, e)
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Failed to get volume stats: {str(e)}")
             return ControllerGetVolumeResponse()
@@ -79,12 +207,12 @@ class ControllerService(ControllerServicer):
         )
 
     def ValidateVolumeCapabilities(self, request, context):
-        logger.info(f"ValidateVolumeCapabilities called for volume: {request.volume_id}")
+        logger.log(V(4), "ValidateVolumeCapabilities called for volume: %s", request.volume_id)
         # 检查卷是否存在
         vol_id = request.volume_id
-        host_path = os.path.join(self.VOLUME_ROOT, vol_id)
-        if not os.path.exists(host_path):
-            logger.error(f"Volume {vol_id} not found")
+        record = self.catalog.get(vol_id)
+        if record is None:
+            logger.error("Volume %s not found", vol_id)
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details(f"Volume {vol_id} not found")
             return ValidateVolumeCapabilitiesResponse()
@@ -92,8 +220,8 @@ class ControllerService(ControllerServicer):
         # 检查请求能力是否支持
         supported = True
         for cap in request.volume_capabilities:
-            # HostPath 仅支持文件系统挂载
-            if cap.HasField("block"):
+            # HostPath 仅支持文件系统挂载，镜像卷也可作为块设备使用
+            if cap.HasField("block") and not is_image_volume(record.parameters):
                 supported = False
                 break
 
@@ -113,44 +241,266 @@ class ControllerService(ControllerServicer):
         )
 
     def CreateVolume(self, request, context):
-        logger.info(f"CreateVolume called for volume: {request.name}")
+        logger.info("CreateVolume called for volume: %s", request.name)
+        return self._exclusive("CreateVolume", request.name, request, context, self._create_volume)
+
+    def _create_volume(self, request, context):
         volume_id = request.name
         capacity = request.capacity_range.required_bytes
         path = request.parameters.get("path", os.path.join(self.VOLUME_ROOT, volume_id))
 
-        if os.path.exists(path):
+        existing = self.catalog.get(volume_id)
+        if existing is not None:
             context.set_code(grpc.StatusCode.ALREADY_EXISTS)
             return CreateVolumeResponse(volume=Volume(
                 volume_id=volume_id,
                 capacity_bytes=capacity,
-                volume_context={"path": path}
+                volume_context=self._volume_context(existing.path, existing.parameters)
             ))
 
+        if request.HasField("volume_content_source"):
+            return self._clone_volume(request, context, path)
+
+        # Volumes at a custom path cannot come from the pool
+        if self.warm_pool is not None and "path" not in request.parameters:
+            response = self._claim_pooled(request, context, path)
+            if response is not None:
+                return response
+
         # Create the host path directory
-        os.makedirs(path, exist_ok=True)
+        with timed("makedirs"):
+            self.backend.makedirs(path, exist_ok=True)
+        if is_image_volume(request.parameters):
+            # Sparse: blocks are only allocated as the volume is written
+            self.backend.truncate(os.path.join(path, IMAGE_FILE), capacity or DEFAULT_IMAGE_SIZE)
+        record = self.catalog.add(volume_id, path, capacity, request.parameters,
+                                  assign_project=self.quota is not None)
+
+        # Enforce the requested size with a project quota on the directory
+        if self.quota is not None:
+            try:
+                self.quota.assign(path, record.project_id, capacity)
+            except QuotaError as e:
+                logger.error("Failed to set quota for volume %s: %s", volume_id, e)
+                self.catalog.remove(volume_id)
+                try:
+                    self.backend.rmtree(path)
+                except OSError:
+                    pass
+                context.abort(grpc.StatusCode.INTERNAL, f"Failed to set quota for volume {volume_id}: {e}")
+        self.capacity.reserve(capacity)
+
+        return CreateVolumeResponse(volume=Volume(
+            volume_id=volume_id,
+            capacity_bytes=capacity,
+            volume_context=self._volume_context(path, request.parameters)
+        ))
 
+    def _claim_pooled(self, request, context, path):
+        volume_id = request.name
+        try:
+            with timed("pool_claim"):
+                claimed = self.warm_pool.claim(path, request.parameters, request.capacity_range)
+        except QuotaError as e:
+            logger.error("Failed to set quota for volume %s: %s", volume_id, e)
+            try:
+                self._discard(path, volume_id)
+            except OSError:
+                pass
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to set quota for volume {volume_id}: {e}")
+        if claimed is None:
+            return None
+        capacity, project_id = claimed
+        self.catalog.add(volume_id, path, capacity, request.parameters, project_id=project_id)
+        self.capacity.reserve(capacity)
+        logger.info("Claimed a pre-provisioned volume for %s", volume_id)
         return CreateVolumeResponse(volume=Volume(
             volume_id=volume_id,
             capacity_bytes=capacity,
-            volume_context={"path": path}
+            volume_context=self._volume_context(path, request.parameters)
+        ))
+
+    def _content_source(self, source, context):
+        """Return (path, size in bytes) of the volume or snapshot to populate a new volume from."""
+        if source.HasField("snapshot"):
+            snapshot_id = source.snapshot.snapshot_id
+            snapshot = self.catalog.get_snapshot(snapshot_id)
+            if snapshot is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Snapshot {snapshot_id} not found")
+            if not snapshot.ready:
+                context.abort(grpc.StatusCode.ABORTED, f"Snapshot {snapshot_id} is not ready yet")
+            return snapshot.path, snapshot.size_bytes
+        if source.HasField("volume"):
+            source_id = source.volume.volume_id
+            volume = self.catalog.get(source_id)
+            if volume is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Volume {source_id} not found")
+            return volume.path, volume.capacity_bytes
+        context.abort(grpc.StatusCode.INVALID_ARGUMENT, "Unsupported volume_content_source")
+
+    def _clone_volume(self, request, context, path):
+        """CreateVolume from a snapshot or another volume.
+
+        The data is copied into VOLUME_ROOT/.clones first and renamed to
+        `path` once complete, so a partially copied volume is never visible.
+        """
+        source = request.volume_content_source
+        if source.HasField("snapshot"):
+            source_id = f"snapshot:{source.snapshot.snapshot_id}"
+        else:
+            source_id = source.volume.volume_id
+        # Keep the source from being deleted or expanded until the copy is done
+        if not self.op_locks.try_acquire(source_id, "CreateVolume"):
+            context.abort(grpc.StatusCode.ABORTED, f"An operation ({self.op_locks.holder(source_id)}) "
+                                                   f"is pending for volume {source_id}")
+        try:
+            return self._populate_volume(request, context, path)
+        finally:
+            self.op_locks.release(source_id)
+
+    def _populate_volume(self, request, context, path):
+        volume_id = request.name
+        source_path, source_size = self._content_source(request.volume_content_source, context)
+        capacity = request.capacity_range.required_bytes or source_size
+        if capacity < source_size:
+            context.abort(grpc.StatusCode.OUT_OF_RANGE,
+                          f"Requested {capacity} bytes, the source needs {source_size}")
+        limit = request.capacity_range.limit_bytes
+        if limit and source_size > limit:
+            context.abort(grpc.StatusCode.OUT_OF_RANGE,
+                          f"Source is {source_size} bytes, above limit_bytes {limit}")
+
+        staging = os.path.join(self.VOLUME_ROOT, CLONE_DIR, volume_id)
+        project_id = self.catalog.allocate_project_id() if self.quota is not None else None
+        try:
+            if self.backend.exists(staging):
+                # Left over by a clone interrupted by a restart
+                with timed("rmtree"):
+                    self.backend.rmtree(staging)
+            self.backend.makedirs(staging, exist_ok=True)
+            if self.quota is not None:
+                # Set before copying so every copied file inherits the project
+                self.quota.assign(staging, project_id, capacity)
+            stats = self.backend.copy_tree(source_path, staging)
+            image = os.path.join(staging, IMAGE_FILE)
+            if self.backend.exists(image) and self.backend.stat(image).st_size < capacity:
+                self.backend.truncate(image, capacity)
+            self.backend.rename(staging, path)
+            if self.quota is not None and not self.quota.persistent:
+                # A project quota follows the renamed inode; the simulated one is re-keyed to `path`
+                self.quota.assign(path, project_id, capacity)
+        except (OSError, QuotaError) as e:
+            logger.error("Failed to clone %s into volume %s: %s", source_path, volume_id, e)
+            if self.quota is not None:
+                try:
+                    self.quota.release(project_id)
+                except QuotaError:
+                    pass
+            try:
+                self._discard(staging, volume_id)
+            except OSError:
+                pass
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to populate volume {volume_id}: {e}")
+        logger.info("Populated volume %s from %s: %s files, %s bytes, %s reflinked, %s hardlinks",
+                    volume_id, source_path, stats.files, stats.bytes, stats.reflinked, stats.hardlinks)
+
+        parameters = dict(request.parameters)
+        if self.backend.exists(os.path.join(path, IMAGE_FILE)):
+            # A copy of an image-backed volume or snapshot is image-backed too
+            parameters["backing"] = "image"
+        self.catalog.add(volume_id, path, capacity, parameters, project_id=project_id)
+        self.capacity.reserve(capacity)
+        return CreateVolumeResponse(volume=Volume(
+            volume_id=volume_id,
+            capacity_bytes=capacity,
+            volume_context=self._volume_context(path, parameters),
+            content_source=request.volume_content_source
         ))
 
     def DeleteVolume(self, request, context):
-        logger.info(f"DeleteVolume called for volume: {request.volume_id}")
+        logger.info("DeleteVolume called for volume: %s", request.volume_id)
+        return self._exclusive("DeleteVolume", request.volume_id, request, context, self._delete_volume)
+
+    def _delete_volume(self, request, context):
         volume_id = request.volume_id
-        volume_path = os.path.join(self.VOLUME_ROOT, volume_id)  # 使用 volume_id 构建路径
+        record = self.catalog.get(volume_id)
+        volume_path = record.path if record else os.path.join(self.VOLUME_ROOT, volume_id)
 
         try:
-            if os.path.exists(volume_path):
-                shutil.rmtree(volume_path)  # 递归删除目录
-                logger.info(f"Deleted HostPath volume: {volume_path}")
+            self._discard(volume_path, volume_id)
+            self.catalog.remove(volume_id)
+            self.fs_stats.forget(volume_path)
+            if record is not None:
+                self.capacity.release(record.capacity_bytes)
+                if self.quota is not None and record.project_id is not None:
+                    try:
+                        self.quota.release(record.project_id)
+                    except QuotaError as e:
+                        logger.warning("Failed to clear quota of volume %s: %s", volume_id, e)
             return DeleteVolumeResponse()
         except OSError as e:
-            logger.error(f"Failed to delete {volume_path}: {e}")
+            logger.error("Failed to delete %s: %s", volume_path, e)
             context.abort(grpc.StatusCode.INTERNAL, f"Failed to delete {volume_path}: {e}")
 
+    def ControllerExpandVolume(self, request, context):
+        logger.info("ControllerExpandVolume called for volume: %s to %s bytes",
+                    request.volume_id, request.capacity_range.required_bytes)
+        return self._exclusive("ControllerExpandVolume", request.volume_id, request, context,
+                               self._expand_volume)
+
+    def _expand_volume(self, request, context):
+        volume_id = request.volume_id
+        if not volume_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "volume_id is required")
+        capacity = request.capacity_range.required_bytes
+        limit = request.capacity_range.limit_bytes
+        if not capacity:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "capacity_range.required_bytes is required")
+        if limit and capacity > limit:
+            context.abort(grpc.StatusCode.OUT_OF_RANGE,
+                          f"required_bytes {capacity} is above limit_bytes {limit}")
+
+        record = self.catalog.get(volume_id)
+        if record is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Volume {volume_id} not found")
+        image = is_image_volume(record.parameters)
+        # Shrinking is not supported; a retry of a finished expansion is a no-op
+        if capacity <= record.capacity_bytes:
+            return ControllerExpandVolumeResponse(capacity_bytes=record.capacity_bytes,
+                                                  node_expansion_required=image)
+
+        try:
+            # 目录卷只需调整配额上限；镜像卷扩展稀疏文件，文件系统由节点在线扩容
+            if self.quota is not None and record.project_id is not None:
+                self.quota.set_limit(record.project_id, capacity)
+            if image:
+                self.backend.truncate(os.path.join(record.path, IMAGE_FILE), capacity)
+        except (OSError, QuotaError) as e:
+            logger.error("Failed to expand volume %s: %s", volume_id, e)
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to expand volume {volume_id}: {e}")
+        self.catalog.set_capacity(volume_id, capacity)
+        self.capacity.reserve(capacity - record.capacity_bytes)
+        logger.info("Expanded volume %s from %s to %s bytes", volume_id, record.capacity_bytes, capacity)
+        return ControllerExpandVolumeResponse(capacity_bytes=capacity, node_expansion_required=image)
+
+    def _discard(self, path, name):
+        """Remove a volume or snapshot directory, via the trash when possible."""
+        if not self.backend.exists(path):
+            return
+        # 原子地移入回收站，由后台 reaper 递归删除
+        try:
+            with timed("move_to_trash"):
+                trash_name = self.reaper.move_to_trash(path, name)
+            logger.info("Moved %s to trash as %s", path, trash_name)
+        except OSError as e:
+            # e.g. EXDEV for a custom "path" on another filesystem
+            logger.warning("Cannot move %s to trash (%s), deleting inline", path, e)
+            with timed("rmtree"):
+                self.backend.rmtree(path)  # 递归删除目录
+            logger.info("Deleted %s", path)
+
     def ControllerPublishVolume(self, request, context):
-        logger.info(f"ControllerPublishVolume called for volume: {request.volume_id} to node: {request.node_id}")
+        logger.info("ControllerPublishVolume called for volume: %s to node: %s", request.volume_id, request.node_id)
         volume_id = request.volume_id
         node_id = request.node_id
 
@@ -158,16 +508,26 @@ class ControllerService(ControllerServicer):
         return ControllerPublishVolumeResponse(publish_context={})
 
     def ControllerUnpublishVolume(self, request, context):
-        logger.info(f"ControllerUnpublishVolume called for volume: {request.volume_id} from node: {request.node_id}")
+        logger.info("ControllerUnpublishVolume called for volume: %s from node: %s", request.volume_id, request.node_id)
         volume_id = request.volume_id
         node_id = request.node_id
 
         # HostPath 无需物理解绑操作
-        logger.info(f"ControllerUnpublishVolume: No action needed for HostPath")
+        logger.info("ControllerUnpublishVolume: No action needed for HostPath")
         return ControllerUnpublishVolumeResponse()
 
+    def GetCapacity(self, request, context):
+        logger.log(V(4), "GetCapacity called")
+        # 从缓存的容量模型直接回答，不访问磁盘
+        available = self.capacity.available()
+        return GetCapacityResponse(
+            available_capacity=available,
+            maximum_volume_size={'value': available},
+            minimum_volume_size={'value': self.capacity.min_volume_size}
+        )
+
     def ControllerGetCapabilities(self, request, context):
-        logger.info("ControllerGetCapabilities called")
+        logger.log(V(4), "ControllerGetCapabilities called")
         return ControllerGetCapabilitiesResponse(
             capabilities=[
                 ControllerServiceCapability(
@@ -199,40 +559,208 @@ class ControllerService(ControllerServicer):
                     rpc=ControllerServiceCapability.RPC(
                         type=ControllerServiceCapability.RPC.VOLUME_CONDITION
                     )
+                ),
+                ControllerServiceCapability(
+                    rpc=ControllerServiceCapability.RPC(
+                        type=ControllerServiceCapability.RPC.CREATE_DELETE_SNAPSHOT
+                    )
+                ),
+                ControllerServiceCapability(
+                    rpc=ControllerServiceCapability.RPC(
+                        type=ControllerServiceCapability.RPC.LIST_SNAPSHOTS
+                    )
+                ),
+                ControllerServiceCapability(
+                    rpc=ControllerServiceCapability.RPC(
+                        type=ControllerServiceCapability.RPC.CLONE_VOLUME
+                    )
+                ),
+                ControllerServiceCapability(
+                    rpc=ControllerServiceCapability.RPC(
+                        type=ControllerServiceCapability.RPC.EXPAND_VOLUME
+                    )
                 )
             ]
         )
 
     def ListVolumes(self, request, context):
-        logger.info("ListVolumes called")
-        base_dir = self.VOLUME_ROOT
+        logger.log(V(4), "ListVolumes called")
         entries = []
 
-        # 获取所有卷（示例简化实现）
-        try:
-            vol_ids = [d for d in os.listdir(base_dir) 
-                       if os.path.isdir(os.path.join(base_dir, d))]
-        except FileNotFoundError:
-            return ListVolumesResponse(entries=[], next_token="0")
-
-        # 分页处理
-        start = int(request.starting_token) if request.starting_token else 0
+        # 分页处理：游标记录上一页最后一个卷 ID 以及目录索引的代数
+        start_after = ""
+        if request.starting_token:
+            try:
+                generation, start_after = decode_list_token(request.starting_token)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.ABORTED, str(e))
+            if generation != self.catalog.generation:
+                context.abort(grpc.StatusCode.ABORTED,
+                              f"starting_token {request.starting_token} is stale, restart listing")
         max_entries = request.max_entries or 100
-        end = start + max_entries
 
-        # 构建返回条目
-        for vol_id in vol_ids[start:end]:
-            volume_path = os.path.join(base_dir, vol_id)
-            capacity_bytes = os.statvfs(volume_path).f_blocks * os.statvfs(volume_path).f_frsize
+        # 构建返回条目（从卷目录索引中按页读取）
+        records = self.catalog.list(start_after=start_after, limit=max_entries + 1)
+        # 同一文件系统上的卷共享一次 statvfs 结果
+        capacities = self.fs_stats.capacity_bytes(record.path for record in records[:max_entries])
+        for record in records[:max_entries]:
             entries.append(ListVolumesResponse.Entry(
                 volume=Volume(
-                    volume_id=vol_id,
-                    capacity_bytes=capacity_bytes,
-                    volume_context={"path": volume_path}
+                    volume_id=record.volume_id,
+                    capacity_bytes=capacities.get(record.path, 0),
+                    volume_context=self._volume_context(record.path, record.parameters)
                 )
             ))
 
-        return ListVolumesResponse(
-            entries=entries,
-            next_token=str(end) if end < len(vol_ids) else ""
-        )
\ No newline at end of file
+        next_token = ""
+        if len(records) > max_entries:
+            next_token = encode_list_token(self.catalog.generation, records[max_entries - 1].volume_id)
+        return ListVolumesResponse(entries=entries, next_token=next_token)
+
+    @staticmethod
+    def _snapshot_message(record):
+        created = Timestamp()
+        created.FromNanoseconds(int(record.created_at * 1e9))
+        return Snapshot(
+            snapshot_id=record.snapshot_id,
+            source_volume_id=record.source_volume_id,
+            size_bytes=record.size_bytes,
+            creation_time=created,
+            ready_to_use=record.ready,
+            group_snapshot_id=record.group_snapshot_id or ""
+        )
+
+    def CreateSnapshot(self, request, context):
+        logger.info("CreateSnapshot called for snapshot: %s of volume: %s", request.name, request.source_volume_id)
+        return self._exclusive("CreateSnapshot", f"snapshot:{request.name}", request, context,
+                               self._create_snapshot)
+
+    def _create_snapshot(self, request, context):
+        snapshot_id = request.name
+        if not snapshot_id or not request.source_volume_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "name and source_volume_id are required")
+
+        record = self.catalog.get_snapshot(snapshot_id)
+        if record is not None and record.source_volume_id != request.source_volume_id:
+            context.abort(grpc.StatusCode.ALREADY_EXISTS,
+                          f"Snapshot {snapshot_id} already exists for volume {record.source_volume_id}")
+
+        with self._snapshot_lock:
+            job = self._snapshot_jobs.get(snapshot_id)
+        if job is not None and job.done() and job.exception() is not None:
+            with self._snapshot_lock:
+                self._snapshot_jobs.pop(snapshot_id, None)
+            # The partial copy is replaced by the next retry
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to copy snapshot {snapshot_id}: {job.exception()}")
+
+        # A copy that is neither done nor running was interrupted by a restart
+        if record is None or (not record.ready and job is None):
+            source = self.catalog.get(request.source_volume_id)
+            if source is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Volume {request.source_volume_id} not found")
+            record, job = self._start_snapshot(snapshot_id, source, context)
+
+        if job is not None:
+            done, _ = futures.wait([job], timeout=self.snapshot_wait)
+            if done and job.exception() is None:
+                with self._snapshot_lock:
+                    self._snapshot_jobs.pop(snapshot_id, None)
+            record = self.catalog.get_snapshot(snapshot_id)
+
+        return CreateSnapshotResponse(snapshot=self._snapshot_message(record))
+
+    def _start_snapshot(self, snapshot_id, source, context):
+        # Keep the source from being deleted or expanded until the copy is done
+        if not self.op_locks.try_acquire(source.volume_id, "CreateSnapshot"):
+            context.abort(grpc.StatusCode.ABORTED, f"An operation ({self.op_locks.holder(source.volume_id)}) "
+                                                   f"is pending for volume {source.volume_id}")
+        path = os.path.join(self.VOLUME_ROOT, SNAPSHOT_DIR, snapshot_id)
+
+        def copy():
+            try:
+                stats = self.backend.copy_tree(source.path, path)
+            except Exception as e:
+                logger.error("Failed to copy volume %s to snapshot %s: %s", source.volume_id, snapshot_id, e)
+                raise
+            finally:
+                self.op_locks.release(source.volume_id)
+            self.catalog.mark_snapshot_ready(snapshot_id, stats.bytes)
+            logger.info("Snapshot %s is ready: %s files, %s bytes, %s reflinked",
+                        snapshot_id, stats.files, stats.bytes, stats.reflinked)
+
+        try:
+            if self.catalog.get(source.volume_id) is None:
+                # Deleted between the lookup and taking the lock
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Volume {source.volume_id} not found")
+            if self.backend.exists(path):
+                with timed("rmtree"):
+                    self.backend.rmtree(path)
+            self.backend.makedirs(os.path.dirname(path), exist_ok=True)
+            self.forget_snapshot_index(snapshot_id)
+            record = self.catalog.add_snapshot(snapshot_id, source.volume_id, path)
+            job = self._snapshot_pool.submit(copy)
+        except BaseException:
+            self.op_locks.release(source.volume_id)
+            raise
+        with self._snapshot_lock:
+            self._snapshot_jobs[snapshot_id] = job
+        return record, job
+
+    def DeleteSnapshot(self, request, context):
+        logger.info("DeleteSnapshot called for snapshot: %s", request.snapshot_id)
+        return self._exclusive("DeleteSnapshot", f"snapshot:{request.snapshot_id}", request, context,
+                               self._delete_snapshot)
+
+    def _delete_snapshot(self, request, context):
+        snapshot_id = request.snapshot_id
+        if not snapshot_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "snapshot_id is required")
+        with self._snapshot_lock:
+            job = self._snapshot_jobs.get(snapshot_id)
+            if job is not None and job.done():
+                del self._snapshot_jobs[snapshot_id]
+        if job is not None and not job.done():
+            context.abort(grpc.StatusCode.ABORTED, f"Snapshot {snapshot_id} is still being created")
+
+        record = self.catalog.get_snapshot(snapshot_id)
+        if record is None:
+            return DeleteSnapshotResponse()
+        if record.group_snapshot_id:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                          f"Snapshot {snapshot_id} belongs to group snapshot {record.group_snapshot_id}")
+        try:
+            self._discard(record.path, snapshot_id)
+        except OSError as e:
+            logger.error("Failed to delete %s: %s", record.path, e)
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to delete {record.path}: {e}")
+        self.forget_snapshot_index(snapshot_id)
+        self.catalog.remove_snapshot(snapshot_id)
+        return DeleteSnapshotResponse()
+
+    def ListSnapshots(self, request, context):
+        logger.log(V(4), "ListSnapshots called")
+        if request.snapshot_id:
+            record = self.catalog.get_snapshot(request.snapshot_id)
+            if record is None or (request.source_volume_id and record.source_volume_id != request.source_volume_id):
+                return ListSnapshotsResponse()
+            return ListSnapshotsResponse(entries=[ListSnapshotsResponse.Entry(snapshot=self._snapshot_message(record))])
+
+        start_after = ""
+        if request.starting_token:
+            try:
+                generation, start_after = decode_list_token(request.starting_token)
+            except ValueError as e:
+                context.abort(grpc.StatusCode.ABORTED, str(e))
+            if generation != self.catalog.generation:
+                context.abort(grpc.StatusCode.ABORTED,
+                              f"starting_token {request.starting_token} is stale, restart listing")
+        max_entries = request.max_entries or 100
+
+        records = self.catalog.list_snapshots(start_after=start_after, limit=max_entries + 1,
+                                              source_volume_id=request.source_volume_id or None)
+        entries = [ListSnapshotsResponse.Entry(snapshot=self._snapshot_message(record))
+                   for record in records[:max_entries]]
+        next_token = ""
+        if len(records) > max_entries:
+            next_token = encode_list_token(self.catalog.generation, records[max_entries - 1].snapshot_id)
+        return ListSnapshotsResponse(entries=entries, next_token=next_token)
@@ -0,0 +1,234 @@
+import os
+import logging
+import threading
+from concurrent import futures
+import grpc
+from google.protobuf.timestamp_pb2 import Timestamp
+from csi.csi_pb2 import (
+    CreateVolumeGroupSnapshotResponse,
+    DeleteVolumeGroupSnapshotResponse,
+    GetVolumeGroupSnapshotResponse,
+    GroupControllerGetCapabilitiesResponse,
+    GroupControllerServiceCapability,
+    VolumeGroupSnapshot
+)
+from csi.csi_pb2_grpc import GroupControllerServicer
+from csi.controller_service import SNAPSHOT_DIR
+from csi.metrics import timed
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+# Upper bound on member volumes captured at the same time
+MAX_PARALLEL_MEMBERS = 32
+
+
+def member_snapshot_id(group_snapshot_id, volume_id):
+    return f"{group_snapshot_id}-{volume_id}"
+
+
+class GroupControllerService(GroupControllerServicer):
+    """Best-effort snapshots of a set of volumes.
+
+    Shares the catalog, copy engine and per-volume locks of the
+    ControllerService. The member volumes are locked against other CSI
+    operations, each backing filesystem is flushed with syncfs, and the
+    member copies wait on a shared barrier that releases them together,
+    then run in parallel, so a group takes about as long as its slowest
+    member.
+
+    Nothing stops workloads from writing while the copies run, so members
+    are NOT crash-consistent with each other (or even within themselves).
+    Host path volumes cannot be frozen on their own: FIFREEZE would stop
+    the whole host filesystem, snapshot copies included, and the loop
+    filesystems of image volumes are mounted by the node plugin, out of
+    the controller's reach. Applications that need a consistent group
+    must quiesce themselves, e.g. through a pre-snapshot hook.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.catalog = controller.catalog
+        self.backend = controller.backend
+        self._pool = futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="csi-group-snapshot")
+        self._lock = threading.Lock()
+        self._jobs = {}  # group_snapshot_id -> Future of the running capture
+
+    def GroupControllerGetCapabilities(self, request, context):
+        logger.log(V(4), "GroupControllerGetCapabilities called")
+        return GroupControllerGetCapabilitiesResponse(
+            capabilities=[
+                GroupControllerServiceCapability(
+                    rpc=GroupControllerServiceCapability.RPC(
+                        type=GroupControllerServiceCapability.RPC.CREATE_DELETE_GET_VOLUME_GROUP_SNAPSHOT
+                    )
+                )
+            ]
+        )
+
+    def _group_message(self, group_snapshot_id, members):
+        created = Timestamp()
+        created.FromNanoseconds(int(min(m.created_at for m in members) * 1e9))
+        return VolumeGroupSnapshot(
+            group_snapshot_id=group_snapshot_id,
+            snapshots=[self.controller._snapshot_message(m) for m in members],
+            creation_time=created,
+            ready_to_use=all(m.ready for m in members)
+        )
+
+    def CreateVolumeGroupSnapshot(self, request, context):
+        logger.info("CreateVolumeGroupSnapshot called for group: %s of volumes: %s",
+                    request.name, list(request.source_volume_ids))
+        return self.controller._exclusive("CreateVolumeGroupSnapshot", f"group:{request.name}",
+                                          request, context, self._create_group_snapshot)
+
+    def _create_group_snapshot(self, request, context):
+        group_snapshot_id = request.name
+        volume_ids = list(dict.fromkeys(request.source_volume_ids))
+        if not group_snapshot_id or not volume_ids:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "name and source_volume_ids are required")
+
+        members = self.catalog.group_snapshots(group_snapshot_id)
+        if members and {m.source_volume_id for m in members} != set(volume_ids):
+            context.abort(grpc.StatusCode.ALREADY_EXISTS,
+                          f"Group snapshot {group_snapshot_id} already exists with different volumes")
+
+        with self._lock:
+            job = self._jobs.get(group_snapshot_id)
+        if job is not None and job.done() and job.exception() is not None:
+            with self._lock:
+                self._jobs.pop(group_snapshot_id, None)
+            context.abort(grpc.StatusCode.INTERNAL,
+                          f"Failed to snapshot group {group_snapshot_id}: {job.exception()}")
+
+        # Not all members ready and nothing running: new, or interrupted by a restart
+        if not members or (not all(m.ready for m in members) and job is None):
+            job = self._start(group_snapshot_id, volume_ids, context)
+
+        if job is not None:
+            done, _ = futures.wait([job], timeout=self.controller.snapshot_wait)
+            if done and job.exception() is None:
+                with self._lock:
+                    self._jobs.pop(group_snapshot_id, None)
+
+        members = self.catalog.group_snapshots(group_snapshot_id)
+        return CreateVolumeGroupSnapshotResponse(group_snapshot=self._group_message(group_snapshot_id, members))
+
+    def _start(self, group_snapshot_id, volume_ids, context):
+        sources = []
+        for volume_id in volume_ids:
+            record = self.catalog.get(volume_id)
+            if record is None:
+                context.abort(grpc.StatusCode.NOT_FOUND, f"Volume {volume_id} not found")
+            sources.append(record)
+
+        # Keep the members from being deleted or changed until the capture is done
+        locks = self.controller.op_locks
+        locked = []
+        for volume_id in volume_ids:
+            if not locks.try_acquire(volume_id, "CreateVolumeGroupSnapshot"):
+                for held in locked:
+                    locks.release(held)
+                context.abort(grpc.StatusCode.ABORTED,
+                              f"An operation ({locks.holder(volume_id)}) is pending for volume {volume_id}")
+            locked.append(volume_id)
+
+        try:
+            targets = []
+            for source in sources:
+                snapshot_id = member_snapshot_id(group_snapshot_id, source.volume_id)
+                path = os.path.join(self.controller.VOLUME_ROOT, SNAPSHOT_DIR, snapshot_id)
+                self.controller.forget_snapshot_index(snapshot_id)
+                self.catalog.add_snapshot(snapshot_id, source.volume_id, path, group_snapshot_id)
+                targets.append((source, snapshot_id, path))
+            job = self._pool.submit(self._capture, group_snapshot_id, targets, locked)
+        except BaseException:
+            for held in locked:
+                locks.release(held)
+            raise
+        with self._lock:
+            self._jobs[group_snapshot_id] = job
+        return job
+
+    def _capture(self, group_snapshot_id, targets, locked):
+        try:
+            for _, _, path in targets:
+                # Left over by a capture interrupted by a restart
+                if self.backend.exists(path):
+                    with timed("rmtree"):
+                        self.backend.rmtree(path)
+            self.backend.makedirs(os.path.join(self.controller.VOLUME_ROOT, SNAPSHOT_DIR), exist_ok=True)
+
+            start = threading.Event()
+
+            def capture(source, snapshot_id, path):
+                start.wait()
+                stats = self.backend.copy_tree(source.path, path)
+                self.catalog.mark_snapshot_ready(snapshot_id, stats.bytes)
+                return stats
+
+            with timed("group_snapshot"), futures.ThreadPoolExecutor(
+                    max_workers=min(len(targets), MAX_PARALLEL_MEMBERS),
+                    thread_name_prefix="csi-group-member") as pool:
+                results = [pool.submit(capture, *target) for target in targets]
+                # Flush every backing filesystem once, then release all copies together
+                try:
+                    with timed("syncfs"):
+                        devices = {}
+                        for source, _, _ in targets:
+                            devices.setdefault(self.backend.stat(source.path).st_dev, source.path)
+                        for path in devices.values():
+                            self.backend.syncfs(path)
+                finally:
+                    start.set()
+                errors = [f.exception() for f in results if f.exception() is not None]
+            if errors:
+                raise errors[0]
+        except Exception as e:
+            logger.error("Failed to snapshot group %s: %s", group_snapshot_id, e)
+            raise
+        finally:
+            for volume_id in locked:
+                self.controller.op_locks.release(volume_id)
+        logger.info("Group snapshot %s is ready: %s volumes", group_snapshot_id, len(targets))
+
+    def _members(self, group_snapshot_id, snapshot_ids, context):
+        members = self.catalog.group_snapshots(group_snapshot_id)
+        if members and snapshot_ids and set(snapshot_ids) != {m.snapshot_id for m in members}:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                          f"snapshot_ids do not match the members of group snapshot {group_snapshot_id}")
+        return members
+
+    def DeleteVolumeGroupSnapshot(self, request, context):
+        logger.info("DeleteVolumeGroupSnapshot called for group: %s", request.group_snapshot_id)
+        return self.controller._exclusive("DeleteVolumeGroupSnapshot", f"group:{request.group_snapshot_id}",
+                                          request, context, self._delete_group_snapshot)
+
+    def _delete_group_snapshot(self, request, context):
+        group_snapshot_id = request.group_snapshot_id
+        if not group_snapshot_id:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "group_snapshot_id is required")
+        with self._lock:
+            job = self._jobs.get(group_snapshot_id)
+            if job is not None and job.done():
+                del self._jobs[group_snapshot_id]
+        if job is not None and not job.done():
+            context.abort(grpc.StatusCode.ABORTED, f"Group snapshot {group_snapshot_id} is still being created")
+
+        for member in self._members(group_snapshot_id, request.snapshot_ids, context):
+            try:
+                self.controller._discard(member.path, member.snapshot_id)
+            except OSError as e:
+                logger.error("Failed to delete %s: %s", member.path, e)
+                context.abort(grpc.StatusCode.INTERNAL, f"Failed to delete {member.path}: {e}")
+            self.controller.forget_snapshot_index(member.snapshot_id)
+            self.catalog.remove_snapshot(member.snapshot_id)
+        return DeleteVolumeGroupSnapshotResponse()
+
+    def GetVolumeGroupSnapshot(self, request, context):
+        logger.log(V(4), "GetVolumeGroupSnapshot called for group: %s", request.group_snapshot_id)
+        group_snapshot_id = request.group_snapshot_id
+        members = self._members(group_snapshot_id, request.snapshot_ids, context)
+        if not members:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Group snapshot {group_snapshot_id} not found")
+        return GetVolumeGroupSnapshotResponse(group_snapshot=self._group_message(group_snapshot_id, members))
@@ -1,21 +1,33 @@
 import logging
 from csi.csi_pb2 import GetPluginInfoResponse, GetPluginCapabilitiesResponse, PluginCapability, ProbeResponse
 from csi.csi_pb2_grpc import IdentityServicer
+from csi.log import V
 
 logger = logging.getLogger('CSIPlugin')
 
 class IdentityService(IdentityServicer):
-    def __init__(self, drivername):
+    def __init__(self, drivername, ready=None, controller=True):
         self.drivername = drivername
+        # threading.Event set once the plugin has finished starting up
+        self.ready = ready
+        # Whether this process serves the controller-side services (see --mode)
+        self.controller = controller
 
     def GetPluginInfo(self, request, context):
-        logger.info("GetPluginInfo called")
+        logger.log(V(4), "GetPluginInfo called")
         return GetPluginInfoResponse(name=self.drivername, vendor_version="v0.1")
 
     def GetPluginCapabilities(self, request, context):
-        logger.info("GetPluginCapabilities called")
-        return GetPluginCapabilitiesResponse(
-            capabilities=[
+        logger.log(V(4), "GetPluginCapabilities called")
+        capabilities = [
+            PluginCapability(
+                volume_expansion=PluginCapability.VolumeExpansion(
+                    type=PluginCapability.VolumeExpansion.ONLINE
+                )
+            ),
+        ]
+        if self.controller:
+            capabilities += [
                 PluginCapability(
                     service=PluginCapability.Service(
                         type=PluginCapability.Service.CONTROLLER_SERVICE
@@ -26,8 +38,13 @@ class IdentityService(IdentityServicer):
                         type=PluginCapability.Service.GROUP_CONTROLLER_SERVICE
                     )
                 ),
+                PluginCapability(
+                    service=PluginCapability.Service(
+                        type=PluginCapability.Service.SNAPSHOT_METADATA_SERVICE
+                    )
+                ),
             ]
-        )
+        return GetPluginCapabilitiesResponse(capabilities=capabilities)
 
     def Probe(self, request, context):
-        return ProbeResponse(ready={'value': True})
\ No newline at end of file
+        return ProbeResponse(ready={'value': self.ready is None or self.ready.is_set()})
\ No newline at end of file
@@ -0,0 +1,118 @@
+import os
+import struct
+import hashlib
+import logging
+from csi.copy_engine import data_segments
+from csi.metrics import timed
+from csi.layout import IMAGE_FILE
+
+logger = logging.getLogger('CSIPlugin')
+
+# Volumes created with the parameter backing=image keep their data in a
+# sparse image file inside the volume directory, attached on the node
+# through a loop device.
+DEFAULT_IMAGE_SIZE = 1 << 30
+
+INDEX_BLOCK_SIZE = 1 << 20
+DIGEST_SIZE = 16
+# Digest recorded for blocks that are entirely a hole
+HOLE = bytes(DIGEST_SIZE)
+
+_HEADER = struct.Struct("<8sQQ")  # magic, block size, image size
+_MAGIC = b"CSIBIDX1"
+
+
+def is_image_volume(parameters):
+    return parameters.get("backing") == "image"
+
+
+def allocated_extents(path, offset=0):
+    """Yield (offset, length) of the allocated ranges of an image file from `offset` on."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        yield from data_segments(fd, os.fstat(fd).st_size, offset)
+    finally:
+        os.close(fd)
+
+
+class BlockIndex:
+    """Checksum of every INDEX_BLOCK_SIZE block of a snapshot's image file.
+
+    Built once per snapshot by reading only its allocated ranges, then
+    kept in a sidecar file. Comparing two indexes yields the blocks that
+    differ between two snapshots without reading either image again.
+    """
+
+    def __init__(self, block_size, image_size, digests):
+        self.block_size = block_size
+        self.image_size = image_size
+        self.digests = digests  # DIGEST_SIZE bytes per block, HOLE for unallocated blocks
+
+    def __len__(self):
+        return len(self.digests) // DIGEST_SIZE
+
+    def digest(self, block):
+        start = block * DIGEST_SIZE
+        return self.digests[start:start + DIGEST_SIZE] if start < len(self.digests) else HOLE
+
+    @classmethod
+    def build(cls, image_path, block_size=INDEX_BLOCK_SIZE):
+        with timed("block_index"), open(image_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            digests = bytearray(HOLE * ((size + block_size - 1) // block_size))
+            for offset, length in data_segments(f.fileno(), size):
+                first = offset // block_size
+                last = (offset + length - 1) // block_size
+                for block in range(first, last + 1):
+                    data = os.pread(f.fileno(), block_size, block * block_size)
+                    digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+                    digests[block * DIGEST_SIZE:(block + 1) * DIGEST_SIZE] = digest
+        return cls(block_size, size, bytes(digests))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            magic, block_size, image_size = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise ValueError(f"{path} is not a block index")
+            return cls(block_size, image_size, f.read())
+
+    def save(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.block_size, self.image_size))
+            f.write(self.digests)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load_or_build(cls, index_path, image_path):
+        try:
+            return cls.load(index_path)
+        except FileNotFoundError:
+            pass
+        index = cls.build(image_path)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            logger.warning("Failed to save block index %s: %s", index_path, e)
+        return index
+
+    def changed_ranges(self, base, offset=0):
+        """Yield merged (offset, length) ranges whose blocks differ from `base`, from `offset` on."""
+        if base.block_size != self.block_size:
+            raise ValueError("block indexes use different block sizes")
+        blocks = max(len(self), len(base))
+        start = None
+        for block in range(offset // self.block_size, blocks):
+            if self.digest(block) != base.digest(block):
+                if start is None:
+                    start = block
+            elif start is not None:
+                yield self._range(start, block)
+                start = None
+        if start is not None:
+            yield self._range(start, blocks)
+
+    def _range(self, first, end):
+        offset = first * self.block_size
+        return offset, min(end * self.block_size, self.image_size) - offset
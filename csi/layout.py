@@ -0,0 +1,18 @@
+# Names of the entries under VOLUME_ROOT that both the controller and the
+# node need to recognise. Kept free of imports so the node plugin can use
+# them without loading the catalog, the reaper or the copy engine.
+
+# Data of an image-backed volume (parameter backing=image)
+IMAGE_FILE = "disk.img"
+
+# Deleted volumes and snapshots wait here for the reaper
+TRASH_DIR = ".trash"
+
+# Directories that are never volumes, e.g. when VOLUME_ROOT is the root of an ext4 filesystem
+RESERVED_NAMES = frozenset(["lost+found"])
+
+
+def is_volume_name(name):
+    """Whether an entry directly under VOLUME_ROOT may be a volume directory."""
+    # Hidden entries are the catalog itself and internal areas (.trash, .snapshots, ...)
+    return not name.startswith(".") and name not in RESERVED_NAMES
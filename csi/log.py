@@ -0,0 +1,84 @@
+import time
+import queue
+import atexit
+import logging
+import threading
+import logging.handlers
+
+LOG_FORMAT = '%(asctime)s %(filename)s: %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def V(level):
+    """klog-style verbosity: a record logged at V(n) is emitted when --v >= n."""
+    return logging.INFO - level
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per message template for records below WARNING.
+
+    Each distinct format string may emit `rate` records per second with
+    bursts of `burst`; the rest are dropped and counted, and the count is
+    appended to the next record that gets through. Warnings and errors are
+    never dropped.
+    """
+
+    def __init__(self, rate=10.0, burst=20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}  # template -> [tokens, last refill, suppressed]
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    # The stock prepare() formats the message on the calling thread so the
+    # record can be pickled; the queue never leaves this process, so hand
+    # the record over as-is and let the listener thread format it.
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(verbosity=0, rate=10.0, burst=20):
+    """Set up the root logger so RPC threads only enqueue records.
+
+    Formatting and stream I/O happen on a QueueListener thread; records
+    are filtered by --v and rate limited before they are enqueued.
+    """
+    root = logging.getLogger()
+    root.setLevel(V(verbosity))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _InProcessQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(rate, burst))
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,130 @@
+import os
+import glob
+import logging
+import subprocess
+from csi.mounter import MountError
+from csi.layout import IMAGE_FILE
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+SYS_BLOCK = "/sys/block"
+
+
+class LoopDevices:
+    """Attaches image files of image-backed volumes to loop devices.
+
+    Lookups read the backing file of every loop device from sysfs instead
+    of running losetup(8), so a retried stage or an unstage that only
+    knows the volume id does not fork a process per call.
+    """
+
+    def __init__(self, sys_block=SYS_BLOCK):
+        self.sys_block = sys_block
+
+    def devices(self):
+        """Map /dev/loopN -> backing file of every attached loop device."""
+        attached = {}
+        for backing in glob.glob(os.path.join(self.sys_block, "loop*", "loop", "backing_file")):
+            name = backing[len(self.sys_block) + 1:].split("/", 1)[0]
+            try:
+                with open(backing) as f:
+                    attached[f"/dev/{name}"] = f.read().strip()
+            except OSError:
+                continue  # detached while scanning
+        return attached
+
+    def find(self, image):
+        image = os.path.realpath(image)
+        for device, backing in self.devices().items():
+            if backing == image:
+                return device
+        return None
+
+    def find_volume(self, volume_id):
+        """Loop devices backed by the image of `volume_id`, wherever its directory is."""
+        suffix = f"/{volume_id}/{IMAGE_FILE}"
+        return [device for device, backing in self.devices().items() if backing.endswith(suffix)]
+
+    def attach(self, image):
+        device = self.find(image)
+        if device is not None:
+            return device
+        try:
+            with timed("losetup"):
+                out = subprocess.run(["losetup", "--find", "--show", image],
+                                     check=True, capture_output=True, text=True).stdout
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"losetup {image} failed: {e.stderr.strip() or e}") from e
+        device = out.strip()
+        logger.info("Attached %s to %s", image, device)
+        return device
+
+    def detach(self, device):
+        try:
+            with timed("losetup"):
+                subprocess.run(["losetup", "--detach", device], check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"losetup --detach {device} failed: {e.stderr.strip() or e}") from e
+        logger.info("Detached %s", device)
+
+    def size(self, device):
+        """Size of the loop device in bytes, as the kernel currently sees it."""
+        with open(os.path.join(self.sys_block, os.path.basename(device), "size")) as f:
+            return int(f.read()) * 512
+
+    def resize(self, device):
+        """Make the loop device pick up a grown image file."""
+        try:
+            with timed("losetup"):
+                subprocess.run(["losetup", "--set-capacity", device], check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"losetup --set-capacity {device} failed: {e.stderr.strip() or e}") from e
+
+
+def filesystem_type(device):
+    """Filesystem on `device` according to blkid(8), or None if it has none."""
+    result = subprocess.run(["blkid", "-p", "-s", "TYPE", "-o", "value", device],
+                            capture_output=True, text=True)
+    # blkid exits 2 when it finds nothing to report
+    if result.returncode == 2:
+        return None
+    if result.returncode != 0:
+        raise MountError(f"blkid {device} failed: {result.stderr.strip()}")
+    return result.stdout.strip() or None
+
+
+def ensure_filesystem(device, fstype):
+    """Create a `fstype` filesystem on a fresh device; never reformats."""
+    existing = filesystem_type(device)
+    if existing is not None:
+        if existing != fstype:
+            logger.warning("%s already has a %s filesystem, not %s", device, existing, fstype)
+        return existing
+    try:
+        with timed("mkfs"):
+            subprocess.run([f"mkfs.{fstype}", "-q", device], check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise MountError(f"mkfs.{fstype} {device} failed: {e.stderr.strip() or e}") from e
+    logger.info("Created %s filesystem on %s", fstype, device)
+    return fstype
+
+
+def grow_filesystem(device, mount_point):
+    """Grow the mounted filesystem on `device` to the size of the device."""
+    fstype = filesystem_type(device)
+    if fstype is None:
+        return  # used as a raw block device
+    if fstype in ("ext2", "ext3", "ext4"):
+        command = ["resize2fs", device]
+    elif fstype == "xfs":
+        # xfs_growfs works on the mount point, not the device
+        command = ["xfs_growfs", mount_point]
+    else:
+        raise MountError(f"Cannot grow {fstype or 'unknown'} filesystem on {device}")
+    try:
+        with timed("resizefs"):
+            subprocess.run(command, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        raise MountError(f"{command[0]} {device} failed: {e.stderr.strip() or e}") from e
+    logger.info("Grew %s filesystem on %s", fstype, device)
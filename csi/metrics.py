@@ -0,0 +1,259 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import grpc
+
+logger = logging.getLogger('CSIPlugin')
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class CallbackMetric(_Metric):
+    """A metric whose single value is read from `fn` at scrape time."""
+
+    def __init__(self, name, help, fn, type="gauge"):
+        super().__init__(name, help)
+        self.type = type
+        self.fn = fn
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}",
+                f"{self.name} {self.fn()}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._values.items())
+        for labels, (counts, count, total) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = _format_labels(self.labelnames, labels, [("le", repr(bound))])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _format_labels(self.labelnames, labels, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{inf} {count}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.warning("Failed to collect metric %s: %s", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+RPC_REQUESTS = REGISTRY.register(Counter(
+    "csi_rpc_requests_total", "CSI RPCs handled, by method and status code.", ["method", "code"]))
+RPC_IN_FLIGHT = REGISTRY.register(Gauge(
+    "csi_rpc_in_flight", "CSI RPCs currently being handled.", ["method"]))
+RPC_DURATION = REGISTRY.register(Histogram(
+    "csi_rpc_duration_seconds", "CSI RPC handling latency.", ["method"]))
+OPERATION_DURATION = REGISTRY.register(Histogram(
+    "csi_operation_duration_seconds",
+    "Latency of filesystem and mount operations (statvfs, mount, umount, rmtree, makedirs, ...).",
+    ["operation"]))
+OPERATION_ERRORS = REGISTRY.register(Counter(
+    "csi_operation_errors_total", "Failed filesystem and mount operations.", ["operation"]))
+
+
+@contextmanager
+def timed(operation):
+    """Record the duration (and failure) of a sub-operation of an RPC."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        OPERATION_ERRORS.inc(operation)
+        raise
+    finally:
+        OPERATION_DURATION.observe(time.perf_counter() - start, operation)
+
+
+def _method_name(handler_call_details):
+    return handler_call_details.method.rsplit("/", 1)[-1]
+
+
+def _code_name(code, default):
+    code = code if code is not None else default
+    return getattr(code, "name", str(code))
+
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Counts, times and tracks in-flight unary RPCs on a grpc.server."""
+
+    def intercept_service(self, continuation, handler_call_details):
+        handler = continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        method = _method_name(handler_call_details)
+        behavior = handler.unary_unary
+
+        def observed(request, context):
+            RPC_IN_FLIGHT.inc(method)
+            start = time.perf_counter()
+            default = grpc.StatusCode.UNKNOWN
+            try:
+                response = behavior(request, context)
+                default = grpc.StatusCode.OK
+                return response
+            finally:
+                RPC_DURATION.observe(time.perf_counter() - start, method)
+                RPC_IN_FLIGHT.dec(method)
+                RPC_REQUESTS.inc(method, _code_name(context.code(), default))
+
+        return grpc.unary_unary_rpc_method_handler(
+            observed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class AsyncMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """MetricsInterceptor for grpc.aio servers."""
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None or handler.unary_unary is None:
+            return handler
+        method = _method_name(handler_call_details)
+        behavior = handler.unary_unary
+
+        async def observed(request, context):
+            RPC_IN_FLIGHT.inc(method)
+            start = time.perf_counter()
+            default = grpc.StatusCode.UNKNOWN
+            try:
+                response = await behavior(request, context)
+                default = grpc.StatusCode.OK
+                return response
+            finally:
+                RPC_DURATION.observe(time.perf_counter() - start, method)
+                RPC_IN_FLIGHT.dec(method)
+                RPC_REQUESTS.inc(method, _code_name(context.code(), default))
+
+        return grpc.unary_unary_rpc_method_handler(
+            observed,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer,
+        )
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(address, registry=REGISTRY):
+    """Serve `registry` on http://<address>/metrics, address being "host:port" or ":port"."""
+    host, _, port = address.rpartition(":")
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    httpd = ThreadingHTTPServer((host or "0.0.0.0", int(port)), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Serving metrics on http://%s/metrics", address)
+    return httpd
@@ -0,0 +1,117 @@
+import os
+import re
+import select
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger('CSIPlugin')
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+# One line of /proc/self/mountinfo, see proc(5). `root` is the directory
+# of the source filesystem that is mounted at `mount_point` (for bind
+# mounts, the bound directory), `source` is the mount source (device).
+MountEntry = namedtuple(
+    "MountEntry",
+    ["mount_id", "parent_id", "device", "root", "mount_point", "fstype", "source"],
+)
+
+_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+def _unescape(field):
+    return _ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text):
+    entries = []
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 10:
+            continue
+        sep = fields.index("-", 6)
+        entries.append(MountEntry(
+            mount_id=int(fields[0]),
+            parent_id=int(fields[1]),
+            device=fields[2],
+            root=_unescape(fields[3]),
+            mount_point=_unescape(fields[4]),
+            fstype=fields[sep + 1],
+            source=_unescape(fields[sep + 2]),
+        ))
+    return entries
+
+
+class MountTable:
+    """In-memory index of the mount table, keyed by mount point.
+
+    The table is parsed once and re-read only when the kernel reports a
+    change: /proc/self/mountinfo signals POLLPRI/POLLERR to pollers
+    whenever the mount namespace changes. Mounts made by this process are
+    recorded immediately through note_mounted/note_unmounted so callers
+    never wait for the watcher to catch up. Mounts stacked on the same
+    mount point are kept in order; lookups see the topmost one.
+    """
+
+    def __init__(self, path=MOUNTINFO, watch=True):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mounts = {}  # mount point -> [MountEntry, ...], bottom first
+        self._watching = False
+        with open(self.path) as f:
+            self._load(f.read())
+        if watch and hasattr(select, "poll"):
+            self._watching = True
+            threading.Thread(target=self._watch, name="mountinfo-watch", daemon=True).start()
+
+    def _load(self, text):
+        mounts = {}
+        # Later lines are mounted on top of earlier ones
+        for entry in parse_mountinfo(text):
+            mounts.setdefault(entry.mount_point, []).append(entry)
+        with self._lock:
+            self._mounts = mounts
+
+    def _watch(self):
+        try:
+            with open(self.path) as f:
+                f.read()
+                poller = select.poll()
+                poller.register(f, select.POLLPRI | select.POLLERR)
+                while True:
+                    poller.poll()
+                    # Reading the file again re-arms the notification
+                    f.seek(0)
+                    self._load(f.read())
+        except OSError as e:
+            logger.warning("Stopped watching %s: %s", self.path, e)
+            self._watching = False
+
+    def refresh(self):
+        with open(self.path) as f:
+            self._load(f.read())
+
+    def get(self, path):
+        if not self._watching:
+            self.refresh()
+        stack = self._mounts.get(os.path.normpath(path))
+        return stack[-1] if stack else None
+
+    def is_mounted(self, path):
+        return self.get(path) is not None
+
+    def note_mounted(self, target, source):
+        target = os.path.normpath(target)
+        with self._lock:
+            self._mounts.setdefault(target, []).append(MountEntry(-1, -1, "", source, target, "none", source))
+
+    def note_unmounted(self, target):
+        """Drop the topmost mount at `target`; mounts below it stay."""
+        target = os.path.normpath(target)
+        with self._lock:
+            stack = self._mounts.get(target)
+            if stack:
+                stack.pop()
+                if not stack:
+                    del self._mounts[target]
@@ -0,0 +1,85 @@
+import os
+import ctypes
+import ctypes.util
+import logging
+import subprocess
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+# <sys/mount.h>
+MS_BIND = 4096
+
+
+class MountError(Exception):
+    def __init__(self, message, errno=None):
+        super().__init__(message)
+        self.errno = errno
+
+
+class SubprocessMounter:
+    """Mounts by running mount(8)/umount(8)."""
+
+    name = "subprocess"
+
+    def bind_mount(self, source, target):
+        try:
+            with timed("mount"):
+                subprocess.run(["mount", "--bind", source, target], check=True)
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"mount --bind {source} {target} failed: {e}") from e
+
+    def mount(self, source, target, fstype):
+        try:
+            with timed("mount"):
+                subprocess.run(["mount", "-t", fstype, source, target], check=True)
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"mount -t {fstype} {source} {target} failed: {e}") from e
+
+    def unmount(self, target):
+        try:
+            with timed("umount"):
+                subprocess.run(["umount", target], check=True)
+        except subprocess.CalledProcessError as e:
+            raise MountError(f"umount {target} failed: {e}") from e
+
+
+class SyscallMounter:
+    """Mounts by calling mount(2)/umount2(2) in-process through libc."""
+
+    name = "syscall"
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._mount = libc.mount
+        self._mount.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                                ctypes.c_ulong, ctypes.c_void_p]
+        self._umount2 = libc.umount2
+        self._umount2.argtypes = [ctypes.c_char_p, ctypes.c_int]
+
+    def bind_mount(self, source, target):
+        with timed("mount"):
+            if self._mount(os.fsencode(source), os.fsencode(target), None, MS_BIND, None) != 0:
+                errno = ctypes.get_errno()
+                raise MountError(f"mount --bind {source} {target} failed: {os.strerror(errno)}", errno)
+
+    def mount(self, source, target, fstype):
+        with timed("mount"):
+            if self._mount(os.fsencode(source), os.fsencode(target), fstype.encode(), 0, None) != 0:
+                errno = ctypes.get_errno()
+                raise MountError(f"mount -t {fstype} {source} {target} failed: {os.strerror(errno)}", errno)
+
+    def unmount(self, target):
+        with timed("umount"):
+            if self._umount2(os.fsencode(target), 0) != 0:
+                errno = ctypes.get_errno()
+                raise MountError(f"umount {target} failed: {os.strerror(errno)}", errno)
+
+
+def new_mounter(kind="syscall"):
+    if kind == "syscall":
+        try:
+            return SyscallMounter()
+        except (OSError, AttributeError) as e:
+            logger.warning("mount(2) not available through libc (%s), falling back to mount(8)", e)
+    return SubprocessMounter()
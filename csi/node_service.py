@@ -1,6 +1,6 @@
 import os
-import subprocess
 import logging
+import grpc
 from csi.csi_pb2 import (
     NodeStageVolumeResponse,
     NodeUnstageVolumeResponse,
@@ -9,111 +9,256 @@ from csi.csi_pb2 import (
     NodeGetInfoResponse,
     NodeGetCapabilitiesResponse,
     NodeGetVolumeStatsResponse,
+    NodeExpandVolumeResponse,
     VolumeUsage,
     VolumeCondition,
     Topology,
     NodeServiceCapability
 )
 from csi.csi_pb2_grpc import NodeServicer
+from csi.mounter import MountError
+from csi.backend import OSBackend
+from csi.loopdev import LoopDevices, ensure_filesystem, grow_filesystem
+from csi.volume_stats import FilesystemStatsCache
+from csi.metrics import timed
+from csi.log import V
 
 logger = logging.getLogger('CSIPlugin')
 
+DEFAULT_FSTYPE = "ext4"
+
+
+def _is_image(volume_context):
+    return volume_context.get("backing") == "image"
+
+
 class NodeService(NodeServicer):
-    def __init__(self, nodeid):
+    def __init__(self, nodeid, backend=None, quota=None, usage_walker=None, stats_ttl=10.0, loop=None):
         self.nodeid = nodeid
+        self.backend = backend or OSBackend()
+        self.loop = loop or LoopDevices()
+        self.quota = quota
+        self.usage_walker = usage_walker
+        self.fs_stats = FilesystemStatsCache(ttl=stats_ttl, backend=self.backend)
+
+    def _quota_usage(self, path, stat):
+        """Per-volume usage from the quota report, or None if the path has no quota."""
+        if self.quota is None:
+            return None
+        project_id = self.quota.project_of(path)
+        usage = self.quota.usage().get(project_id) if project_id else None
+        if usage is None or not usage.limit_bytes:
+            return None
+        return [
+            VolumeUsage(
+                total=usage.limit_bytes,
+                available=max(0, usage.limit_bytes - usage.used_bytes),
+                used=usage.used_bytes,
+                unit=VolumeUsage.Unit.BYTES
+            ),
+            VolumeUsage(
+                total=stat.f_files,
+                available=stat.f_favail,
+                used=usage.used_inodes,
+                unit=VolumeUsage.Unit.INODES
+            ),
+        ]
+
+    def _walker_usage(self, path, stat):
+        """Per-volume usage from the background walker, or None until its first scan."""
+        if self.usage_walker is None:
+            return None
+        # Also picks up volumes published before a plugin restart
+        self.usage_walker.track(path)
+        used = self.usage_walker.usage(path)
+        if used is None:
+            return None
+        used_bytes, used_inodes = used
+        return [
+            VolumeUsage(
+                total=stat.f_blocks * stat.f_frsize,
+                available=stat.f_bavail * stat.f_frsize,
+                used=used_bytes,
+                unit=VolumeUsage.Unit.BYTES
+            ),
+            VolumeUsage(
+                total=stat.f_files,
+                available=stat.f_favail,
+                used=used_inodes,
+                unit=VolumeUsage.Unit.INODES
+            ),
+        ]
 
     def NodeStageVolume(self, request, context):
-        logger.info(f"NodeStageVolume called for volume: {request.volume_id}")
+        logger.info("NodeStageVolume called for volume: %s", request.volume_id)
         volume_id = request.volume_id
         staging_target_path = request.staging_target_path
         src_path = request.volume_context["path"]
 
         # Check if the source path exists
-        if not os.path.exists(src_path):
-            logger.error(f"HostPath directory {src_path} does not exist")
+        if not self.backend.exists(src_path):
+            logger.error("HostPath directory %s does not exist", src_path)
             context.abort(grpc.StatusCode.NOT_FOUND, f"HostPath directory {src_path} does not exist")
 
+        if _is_image(request.volume_context):
+            self._stage_image(request, context)
+            return NodeStageVolumeResponse()
+
         # HostPath 通常无需额外操作（如格式化），直接返回成功
         return NodeStageVolumeResponse()
 
+    def _stage_image(self, request, context):
+        """Attach the volume's image to a loop device and, for mount access, mount its filesystem at staging."""
+        image = request.volume_context["image"]
+        staging_target_path = request.staging_target_path
+        try:
+            device = self.loop.attach(image)
+            if request.volume_capability.HasField("block"):
+                return
+            if self.backend.mount_source(staging_target_path) is not None:
+                return
+            fstype = request.volume_capability.mount.fs_type or DEFAULT_FSTYPE
+            fstype = ensure_filesystem(device, fstype)
+            self.backend.makedirs(staging_target_path, exist_ok=True)
+            self.backend.mount(device, staging_target_path, fstype)
+            logger.info("Mounted %s (%s) at %s", device, image, staging_target_path)
+        except MountError as e:
+            logger.error("Failed to stage %s: %s", image, e)
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to stage {image}: {e}")
+
     def NodeUnstageVolume(self, request, context):
-        logger.info(f"NodeUnstageVolume called for volume: {request.volume_id}")
+        logger.info("NodeUnstageVolume called for volume: %s", request.volume_id)
         volume_id = request.volume_id
         staging_target_path = request.staging_target_path
 
         try:
             # 如果存在全局挂载点则卸载
-            if os.path.ismount(staging_target_path):
-                subprocess.run(["umount", staging_target_path], check=True)
-                logger.info(f"Unmounted staging path: {staging_target_path}")
+            if self.backend.ismount(staging_target_path):
+                self.backend.unmount(staging_target_path)
+                logger.info("Unmounted staging path: %s", staging_target_path)
 
             # 删除临时目录
-            if os.path.exists(staging_target_path):
-                os.rmdir(staging_target_path)
-                logger.info(f"Removed staging directory: {staging_target_path}")
+            if self.backend.exists(staging_target_path):
+                self.backend.rmdir(staging_target_path)
+                logger.info("Removed staging directory: %s", staging_target_path)
+
+            # 镜像卷：释放 loop 设备（请求中没有卷上下文，按镜像路径查找）
+            for device in self.loop.find_volume(volume_id):
+                self.loop.detach(device)
 
             return NodeUnstageVolumeResponse()
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Unmount failed: {e}")
+        except MountError as e:
+            logger.error("Unmount failed: %s", e)
             context.abort(grpc.StatusCode.INTERNAL, f"Unmount failed: {e}")
         except Exception as e:
-            logger.error(f"An error occurred while unstaging volume {volume_id}: {e}")
+            logger.error("An error occurred while unstaging volume %s: %s", volume_id, e)
             context.abort(grpc.StatusCode.INTERNAL, f"An error occurred while unstaging volume {volume_id}: {e}")
 
     def NodePublishVolume(self, request, context):
-        logger.info(f"NodePublishVolume called for volume: {request.volume_id}")
+        logger.info("NodePublishVolume called for volume: %s", request.volume_id)
         volume_id = request.volume_id
         target_path = request.target_path
         staging_target_path = request.staging_target_path
         src_path = request.volume_context["path"]
 
+        # Retried publish of an already mounted target is a no-op
+        mounted = self.backend.mount_source(target_path)
+        if mounted is not None:
+            logger.info("%s is already mounted from %s", target_path, mounted)
+            return NodePublishVolumeResponse()
+
         try:
             # Check if the staging target path exists
-            if not os.path.exists(staging_target_path):
-                logger.error(f"Staging target path {staging_target_path} does not exist")
+            if not self.backend.exists(staging_target_path):
+                logger.error("Staging target path %s does not exist", staging_target_path)
                 context.abort(grpc.StatusCode.NOT_FOUND, f"Staging target path {staging_target_path} does not exist")
 
-            # Create the directory for the target path if it does not exist
-            os.makedirs(target_path, exist_ok=True)
+            if _is_image(request.volume_context):
+                if request.volume_capability.HasField("block"):
+                    # Raw block access: bind the loop device onto a file
+                    src_path = self.loop.attach(request.volume_context["image"])
+                    self.backend.makedirs(os.path.dirname(target_path), exist_ok=True)
+                    if not self.backend.exists(target_path):
+                        self.backend.truncate(target_path, 0)
+                else:
+                    src_path = staging_target_path
+
+            if not self.backend.exists(target_path):
+                # Create the directory for the target path if it does not exist
+                with timed("makedirs"):
+                    self.backend.makedirs(target_path, exist_ok=True)
 
             # Perform bind mount: mount the host path directory to the pod path
-            subprocess.run(["mount", "--bind", src_path, target_path], check=True)
-            logger.info(f"Mounted {src_path} to {target_path}")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to mount {src_path} to {target_path}: {e}")
+            self.backend.bind_mount(src_path, target_path)
+            if self.usage_walker is not None:
+                self.usage_walker.track(target_path)
+            logger.info("Mounted %s to %s", src_path, target_path)
+        except MountError as e:
+            logger.error("Failed to mount %s to %s: %s", src_path, target_path, e)
             context.abort(grpc.StatusCode.INTERNAL, f"Failed to mount {src_path} to {target_path}: {e}")
         except Exception as e:
-            logger.error(f"An error occurred while publishing volume {volume_id}: {e}")
+            logger.error("An error occurred while publishing volume %s: %s", volume_id, e)
             context.abort(grpc.StatusCode.INTERNAL, f"An error occurred while publishing volume {volume_id}: {e}")
 
         return NodePublishVolumeResponse()
 
     def NodeUnpublishVolume(self, request, context):
-        logger.info(f"NodeUnpublishVolume called for volume: {request.volume_id}")
+        logger.info("NodeUnpublishVolume called for volume: %s", request.volume_id)
         volume_id = request.volume_id
         target_path = request.target_path
 
         try:
             # 卸载 Pod 挂载点
-            if os.path.ismount(target_path):
-                subprocess.run(["umount", target_path], check=True)
-                logger.info(f"Unmounted pod path: {target_path}")
+            if self.backend.ismount(target_path):
+                self.backend.unmount(target_path)
+                logger.info("Unmounted pod path: %s", target_path)
+            if self.usage_walker is not None:
+                self.usage_walker.untrack(target_path)
+            self.fs_stats.forget(target_path)
 
-            # 删除空目录（Kubernetes 预期行为）
-            if os.path.exists(target_path):
-                os.rmdir(target_path)
-                logger.info(f"Removed pod mount directory: {target_path}")
+            # 删除空目录（Kubernetes 预期行为）；块设备卷的挂载点是文件
+            if self.backend.isdir(target_path):
+                self.backend.rmdir(target_path)
+                logger.info("Removed pod mount directory: %s", target_path)
+            elif self.backend.exists(target_path):
+                self.backend.unlink(target_path)
+                logger.info("Removed pod block device file: %s", target_path)
 
             return NodeUnpublishVolumeResponse()
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Unmount failed: {e}")
+        except MountError as e:
+            logger.error("Unmount failed: %s", e)
             context.abort(grpc.StatusCode.INTERNAL, f"Unmount failed: {e}")
         except Exception as e:
-            logger.error(f"An error occurred while unpublishing volume {volume_id}: {e}")
+            logger.error("An error occurred while unpublishing volume %s: %s", volume_id, e)
             context.abort(grpc.StatusCode.INTERNAL, f"An error occurred while unpublishing volume {volume_id}: {e}")
 
+    def NodeExpandVolume(self, request, context):
+        logger.info("NodeExpandVolume called for volume: %s at %s", request.volume_id, request.volume_path)
+        volume_id = request.volume_id
+        if not volume_id or not request.volume_path:
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, "volume_id and volume_path are required")
+        if not self.backend.exists(request.volume_path):
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Path {request.volume_path} not found")
+
+        devices = self.loop.find_volume(volume_id)
+        if not devices:
+            # 目录卷的容量由控制器端配额决定，节点无需操作
+            return NodeExpandVolumeResponse(capacity_bytes=request.capacity_range.required_bytes)
+
+        try:
+            for device in devices:
+                self.loop.resize(device)
+                if not request.volume_capability.HasField("block"):
+                    # Online: the filesystem stays mounted while it grows
+                    grow_filesystem(device, request.staging_target_path or request.volume_path)
+            self.fs_stats.forget(request.volume_path)
+            return NodeExpandVolumeResponse(capacity_bytes=self.loop.size(devices[0]))
+        except (MountError, OSError) as e:
+            logger.error("Failed to expand volume %s: %s", volume_id, e)
+            context.abort(grpc.StatusCode.INTERNAL, f"Failed to expand volume {volume_id}: {e}")
+
     def NodeGetCapabilities(self, request, context):
-        logger.info("NodeGetCapabilities called")
+        logger.log(V(4), "NodeGetCapabilities called")
         return NodeGetCapabilitiesResponse(
             capabilities=[
                 NodeServiceCapability(
@@ -135,48 +280,56 @@ class NodeService(NodeServicer):
                     rpc=NodeServiceCapability.RPC(
                         type=NodeServiceCapability.RPC.SINGLE_NODE_MULTI_WRITER
                     )
+                ),
+                NodeServiceCapability(
+                    rpc=NodeServiceCapability.RPC(
+                        type=NodeServiceCapability.RPC.EXPAND_VOLUME
+                    )
                 )
             ]
         )
 
     def NodeGetInfo(self, request, context):
-        logger.info("NodeGetInfo called")
+        logger.log(V(4), "NodeGetInfo called")
         return NodeGetInfoResponse(
             node_id=self.nodeid,  # 保持使用 nodeid
         )
 
     def NodeGetVolumeStats(self, request, context):
-        logger.info(f"NodeGetVolumeStats called for volume path: {request.volume_path}")
+        logger.log(V(4), "NodeGetVolumeStats called for volume path: %s", request.volume_path)
         path = request.volume_path  # 例如 /data/hostpath-vol1
 
-        if not os.path.exists(path):
-            logger.error(f"Path {path} not found")
+        if not self.backend.exists(path):
+            logger.error("Path %s not found", path)
             context.set_code(grpc.StatusCode.NOT_FOUND)
             context.set_details(f"Path {path} not found")
             return NodeGetVolumeStatsResponse()
 
         try:
-            stat = os.statvfs(path)
-            total_bytes = stat.f_blocks * stat.f_frsize
-            available_bytes = stat.f_bavail * stat.f_frsize
-            used_bytes = total_bytes - available_bytes
-
-            return NodeGetVolumeStatsResponse(
-                usage=[
+            stat = self.fs_stats.statvfs(path)
+            usage = self._quota_usage(path, stat) or self._walker_usage(path, stat)
+            if usage is None:
+                total_bytes = stat.f_blocks * stat.f_frsize
+                available_bytes = stat.f_bavail * stat.f_frsize
+                used_bytes = total_bytes - available_bytes
+                usage = [
                     VolumeUsage(
                         total=total_bytes,
                         available=available_bytes,
                         used=used_bytes,
                         unit=VolumeUsage.Unit.BYTES
                     )
-                ],
+                ]
+
+            return NodeGetVolumeStatsResponse(
+                usage=usage,
                 volume_condition=VolumeCondition(
                     abnormal=False,
                     message="Volume is healthy"
                 )
             )
         except Exception as e:
-            logger.error(f"Failed to get stats for path {path}: {e}")
+            logger.error("Failed to get stats for path %s: %s", path, e)
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Failed to get stats: {str(e)}")
             return NodeGetVolumeStatsResponse()
\ No newline at end of file
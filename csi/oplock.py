@@ -0,0 +1,71 @@
+import threading
+
+
+class OperationLocks:
+    """Non-blocking per-volume lock table.
+
+    CSI expects a plugin to answer ABORTED ("operation pending") instead of
+    queueing when an operation is already in progress for the same volume,
+    so callers only ever try_acquire.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._held = {}  # volume_id -> operation name
+
+    def try_acquire(self, volume_id, operation):
+        with self._lock:
+            if volume_id in self._held:
+                return False
+            self._held[volume_id] = operation
+            return True
+
+    def release(self, volume_id):
+        with self._lock:
+            self._held.pop(volume_id, None)
+
+    def holder(self, volume_id):
+        with self._lock:
+            return self._held.get(volume_id)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is still
+    running wait for it and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
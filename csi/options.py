@@ -6,5 +6,55 @@ def parse_args():
     parser.add_argument('--v', type=int, default=0, help='Log level verbosity')
     parser.add_argument('--endpoint', type=str, required=True, help='CSI endpoint')
     parser.add_argument('--nodeid', type=str, required=True, help='Node ID')
+    parser.add_argument('--mode', choices=['controller', 'node', 'all'], default='all',
+                        help='Services to serve: the controller plugin, the per-node plugin, or both')
     parser.add_argument('--volume-root', type=str, default='/mnt/hostpath', help='Root directory for volumes')
+    parser.add_argument('--stats-ttl', type=float, default=10.0, help='Seconds to cache filesystem statvfs results')
+    parser.add_argument('--capacity-refresh', type=float, default=30.0,
+                        help='Seconds between statvfs samples of the volume root for GetCapacity')
+    parser.add_argument('--quota', choices=['none', 'project', 'simulated'], default='none',
+                        help='Per-volume capacity enforcement: XFS/ext4 project quotas, or simulated accounting')
+    parser.add_argument('--usage-scan-interval', type=float, default=60.0,
+                        help='Seconds between background usage scans of published volumes')
+    parser.add_argument('--usage-scan-budget', type=int, default=5000,
+                        help='Max files/directories the usage walker stats per second (0 = unlimited)')
+    parser.add_argument('--reaper-rate', type=int, default=2000,
+                        help='Max unlink/rmdir calls per second when purging deleted volumes (0 = unlimited)')
+    parser.add_argument('--copy-workers', type=int, default=4,
+                        help='Threads copying files for snapshots when the filesystem has no reflink support')
+    parser.add_argument('--snapshot-wait', type=float, default=1.0,
+                        help='Seconds CreateSnapshot waits for the copy before returning ready_to_use=false')
+    parser.add_argument('--warm-pool', action='append', default=[], metavar='SIZE:CAPACITY[:key=value,...]',
+                        help='Keep SIZE pre-provisioned volumes of CAPACITY bytes for CreateVolume requests '
+                             'with exactly these parameters (repeatable)')
+    parser.add_argument('--warm-pool-interval', type=float, default=30.0,
+                        help='Seconds between warm pool refills when no volume has been claimed')
+    parser.add_argument('--reconcile-workers', type=int, default=8,
+                        help='Threads listing directories while reconciling volumes and mounts at startup')
+    parser.add_argument('--mounter', choices=['syscall', 'subprocess'], default='syscall',
+                        help='Mount backend: mount(2) via libc, or fork mount(8)/umount(8)')
+    parser.add_argument('--metrics-address', type=str, default='',
+                        help='Serve Prometheus metrics on http://<address>/metrics, e.g. ":9808" (disabled if empty)')
+    parser.add_argument('--log-rate', type=float, default=10.0,
+                        help='Max log lines per second per message type below WARNING (0 = unlimited)')
+    parser.add_argument('--max-concurrent-rpcs', type=int, default=100,
+                        help='RPCs the server accepts at once, running or queued; more are rejected (0 = unlimited)')
+    parser.add_argument('--admission-concurrency', type=int, default=8,
+                        help='Initial concurrency limit per RPC method, adapted AIMD-style (0 = no admission control)')
+    parser.add_argument('--admission-max-concurrency', type=int, default=64,
+                        help='Upper bound for the adaptive per-method concurrency limit')
+    parser.add_argument('--admission-queue', type=int, default=32,
+                        help='Calls per method that may wait for a slot before new ones are rejected')
+    parser.add_argument('--admission-latency-target', type=float, default=5.0,
+                        help='Seconds; slower calls shrink their method\'s concurrency limit')
+    parser.add_argument('--admission-limit', action='append', default=[], metavar='METHOD=LIMIT[:QUEUE]',
+                        help='Per-method initial limit and queue depth, e.g. DeleteVolume=2:8 (repeatable)')
+    parser.add_argument('--async', dest='async_mode', action='store_true', help='Serve with grpc.aio instead of a thread pool')
+    parser.add_argument('--controller-workers', type=int, default=8,
+                        help='Threads for Controller, GroupController and SnapshotMetadata RPCs')
+    parser.add_argument('--node-workers', type=int, default=8, help='Threads for Node RPCs')
+    parser.add_argument('--identity-workers', type=int, default=0,
+                        help='Threads for Identity RPCs (0 = answer them on the server thread)')
+    parser.add_argument('--bulkhead-queue', type=int, default=32,
+                        help='Calls per service class that may wait for a thread before new ones are rejected (0 = unbounded)')
     return parser.parse_args()
\ No newline at end of file
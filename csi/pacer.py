@@ -0,0 +1,27 @@
+import time
+import threading
+
+
+class Pacer:
+    """Keeps a background loop under `rate` operations per second.
+
+    Callers report the work they are about to do; the pacer sleeps once
+    they get ahead of schedule, in slices of at least `granularity`
+    seconds rather than once per operation. A rate of 0 disables pacing.
+    """
+
+    def __init__(self, rate, granularity=0.01):
+        self.rate = rate
+        self.granularity = granularity
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self, n=1):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot = max(self._next_slot, now) + n / self.rate
+            delay = self._next_slot - now
+        if delay > self.granularity:
+            time.sleep(delay)
@@ -0,0 +1,254 @@
+import os
+import fcntl
+import shutil
+import struct
+import logging
+import threading
+import subprocess
+from collections import namedtuple
+from csi.backend import OSBackend
+from csi.mount_table import parse_mountinfo, MOUNTINFO
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+# <linux/fs.h>: struct fsxattr and the ioctls to read/write it
+_FSXATTR = struct.Struct("=IIIII8s")
+FS_IOC_FSGETXATTR = 0x801C581F
+FS_IOC_FSSETXATTR = 0x401C5820
+FS_XFLAG_PROJINHERIT = 0x00000200
+
+
+class QuotaError(Exception):
+    pass
+
+
+QuotaUsage = namedtuple("QuotaUsage", ["used_bytes", "used_inodes", "limit_bytes"])
+
+
+def _mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def _fstype(mount_point):
+    with open(MOUNTINFO) as f:
+        entries = [e for e in parse_mountinfo(f.read()) if e.mount_point == mount_point]
+    return entries[-1].fstype if entries else ""
+
+
+class _BackgroundReport:
+    """Usage report refreshed on a background thread.
+
+    The report is rebuilt every `report_ttl` seconds, and right away after
+    a limit changes; usage() only returns the cached copy, so RPCs never
+    wait for an xfs_quota run or a tree walk.
+    """
+
+    def _start_report(self):
+        self._report = {}
+        self._report_wakeup = threading.Event()
+        self._refresh_report()
+        threading.Thread(target=self._run_report, name="quota-report", daemon=True).start()
+
+    def _refresh_report(self):
+        try:
+            with timed("quota_report"):
+                self._report = self._build_report()
+        except (OSError, QuotaError) as e:
+            logger.error("Failed to refresh %s quota report: %s", self.name, e)
+
+    def _run_report(self):
+        while True:
+            self._report_wakeup.wait(self.report_ttl)
+            self._report_wakeup.clear()
+            self._refresh_report()
+
+    def usage(self):
+        return self._report
+
+
+class SimulatedQuota(_BackgroundReport):
+    """Quota backend for filesystems without project quota support.
+
+    Limits are only recorded, not enforced. Usage comes from the shared
+    UsageWalker when one is given, otherwise from walking the volume
+    directories on every report refresh.
+    """
+
+    name = "simulated"
+    persistent = False  # limits live in memory and must be re-assigned after a restart
+
+    def __init__(self, report_ttl=30.0, walker=None, backend=None):
+        self.report_ttl = report_ttl
+        self.walker = walker
+        self.backend = backend or OSBackend()
+        self._lock = threading.Lock()
+        self._volumes = {}   # project_id -> [path, limit_bytes, (st_dev, st_ino)]
+        self._inodes = {}    # (st_dev, st_ino) of the volume directory -> project_id
+        self._start_report()
+
+    def assign(self, path, project_id, limit_bytes):
+        try:
+            st = self.backend.stat(path)
+        except OSError as e:
+            raise QuotaError(f"Failed to assign project id {project_id} to {path}: {e}") from e
+        key = (st.st_dev, st.st_ino)
+        with self._lock:
+            # Re-assigning moves the project, e.g. from a pool or clone staging path to the volume's
+            previous = self._volumes.get(project_id)
+            if previous is not None and previous[2] != key:
+                self._inodes.pop(previous[2], None)
+            self._volumes[project_id] = [path, limit_bytes, key]
+            self._inodes[key] = project_id
+        self._report_wakeup.set()
+        if self.walker is not None:
+            if previous is not None and previous[0] != path:
+                self.walker.untrack(previous[0])
+            self.walker.track(path)
+
+    def set_limit(self, project_id, limit_bytes):
+        with self._lock:
+            if project_id in self._volumes:
+                self._volumes[project_id][1] = limit_bytes
+        self._report_wakeup.set()
+
+    def release(self, project_id):
+        with self._lock:
+            volume = self._volumes.pop(project_id, None)
+            if volume is not None and self._inodes.get(volume[2]) == project_id:
+                del self._inodes[volume[2]]
+        if volume is not None and self.walker is not None:
+            self.walker.untrack(volume[0])
+
+    def project_of(self, path):
+        # A bind mount of the volume shows the same inode as the source directory
+        st = self.backend.stat(path)
+        return self._inodes.get((st.st_dev, st.st_ino))
+
+    def _measure(self, path):
+        if self.walker is not None:
+            return self.walker.usage(path) or (0, 0)
+        used_bytes = used_inodes = 0
+        stack = [path]
+        while stack:
+            try:
+                for entry in self.backend.scandir(stack.pop()):
+                    used_inodes += 1
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        used_bytes += entry.stat(follow_symlinks=False).st_blocks * 512
+            except OSError:
+                continue
+        return used_bytes, used_inodes
+
+    def _build_report(self):
+        with self._lock:
+            volumes = dict(self._volumes)
+        report = {}
+        for project_id, (path, limit_bytes, _) in volumes.items():
+            used_bytes, used_inodes = self._measure(path)
+            report[project_id] = QuotaUsage(used_bytes, used_inodes, limit_bytes)
+        return report
+
+
+class ProjectQuota(_BackgroundReport):
+    """XFS/ext4 project quotas.
+
+    Volume directories are tagged with a project id (inherited by
+    everything created below them) through FS_IOC_FSSETXATTR, hard block
+    limits are set with xfs_quota, and usage for all projects comes from a
+    single `xfs_quota report` per background refresh.
+    """
+
+    name = "project"
+    persistent = True
+
+    def __init__(self, volume_root, report_ttl=30.0):
+        self.mount_point = _mount_point(volume_root)
+        self.fstype = _fstype(self.mount_point)
+        self.report_ttl = report_ttl
+        if shutil.which("xfs_quota") is None:
+            raise OSError("xfs_quota not found")
+        # Fails with ENOTTY/EOPNOTSUPP on filesystems without project ids
+        self._get_xattr(volume_root)
+        self._start_report()
+
+    def _xfs_quota(self, *commands):
+        cmd = ["xfs_quota", "-x"]
+        if self.fstype != "xfs":
+            cmd.append("-f")  # foreign filesystem (ext4) mode
+        for command in commands:
+            cmd += ["-c", command]
+        cmd.append(self.mount_point)
+        try:
+            with timed("xfs_quota"):
+                return subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        except subprocess.CalledProcessError as e:
+            raise QuotaError(f"{' '.join(cmd)} failed: {e.stderr.strip() or e}") from e
+
+    @staticmethod
+    def _get_xattr(path):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            buf = fcntl.ioctl(fd, FS_IOC_FSGETXATTR, bytes(_FSXATTR.size))
+            return list(_FSXATTR.unpack(buf))
+        finally:
+            os.close(fd)
+
+    def assign(self, path, project_id, limit_bytes):
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                xflags, extsize, nextents, _, cowextsize, pad = _FSXATTR.unpack(
+                    fcntl.ioctl(fd, FS_IOC_FSGETXATTR, bytes(_FSXATTR.size)))
+                fcntl.ioctl(fd, FS_IOC_FSSETXATTR, _FSXATTR.pack(
+                    xflags | FS_XFLAG_PROJINHERIT, extsize, nextents, project_id, cowextsize, pad))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            raise QuotaError(f"Failed to set project id {project_id} on {path}: {e}") from e
+        self.set_limit(project_id, limit_bytes)
+
+    def set_limit(self, project_id, limit_bytes):
+        self._xfs_quota(f"limit -p bhard={limit_bytes} {project_id}")
+        self._report_wakeup.set()
+
+    def release(self, project_id):
+        self._xfs_quota(f"limit -p bhard=0 ihard=0 {project_id}")
+
+    def project_of(self, path):
+        project_id = self._get_xattr(path)[3]
+        return project_id or None
+
+    @staticmethod
+    def _parse_report(text):
+        # "#<id> <used> <soft> <hard> <warn/grace...>", values in KiB for -b
+        rows = {}
+        for line in text.splitlines():
+            fields = line.split()
+            if len(fields) >= 4 and fields[0].startswith("#"):
+                rows[int(fields[0][1:])] = (int(fields[1]), int(fields[3]))
+        return rows
+
+    def _build_report(self):
+        blocks = self._parse_report(self._xfs_quota("report -p -b -n -N"))
+        inodes = self._parse_report(self._xfs_quota("report -p -i -n -N"))
+        report = {}
+        for project_id, (used_kb, hard_kb) in blocks.items():
+            report[project_id] = QuotaUsage(used_kb * 1024, inodes.get(project_id, (0, 0))[0], hard_kb * 1024)
+        return report
+
+
+def new_quota_backend(kind, volume_root, walker=None, backend=None):
+    if kind == "none":
+        return None
+    if kind == "project":
+        try:
+            return ProjectQuota(volume_root)
+        except (OSError, QuotaError) as e:
+            logger.warning("Project quotas unavailable on %s (%s), using simulated quotas", volume_root, e)
+    return SimulatedQuota(walker=walker, backend=backend)
@@ -0,0 +1,90 @@
+import os
+import time
+import logging
+import threading
+from csi.backend import OSBackend
+from csi.layout import TRASH_DIR
+from csi.pacer import Pacer
+from csi.metrics import timed
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+
+class TrashReaper:
+    """Deletes volumes that DeleteVolume moved into VOLUME_ROOT/.trash.
+
+    DeleteVolume only renames the volume directory, which is atomic and
+    constant time; the actual tree removal happens here on a background
+    thread, limited to `rate` unlink/rmdir calls per second (0 means no
+    limit) so it does not starve the disk for live volumes.
+    """
+
+    def __init__(self, volume_root, rate=2000, interval=5.0, backend=None):
+        self.trash_root = os.path.join(volume_root, TRASH_DIR)
+        self.rate = rate
+        self._pacer = Pacer(rate)
+        self.interval = interval
+        self.backend = backend or OSBackend()
+        self.backend.makedirs(self.trash_root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = set()
+        self._bytes_reclaimed = 0
+        self._entries_reclaimed = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trash-reaper", daemon=True)
+            self._thread.start()
+        return self
+
+    def move_to_trash(self, path, volume_id):
+        """Atomically move `path` into the trash; raises OSError (e.g. EXDEV) on failure."""
+        name = f"{volume_id}.{time.time_ns()}"
+        self.backend.rename(path, os.path.join(self.trash_root, name))
+        with self._lock:
+            self._pending.add(name)
+        self._wakeup.set()
+        return name
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": len(self._pending),
+                "bytes_reclaimed": self._bytes_reclaimed,
+                "entries_reclaimed": self._entries_reclaimed,
+            }
+
+    def _run(self):
+        while True:
+            try:
+                names = self.backend.listdir(self.trash_root)
+            except OSError as e:
+                logger.error("Failed to list %s: %s", self.trash_root, e)
+                names = []
+            with self._lock:
+                self._pending.update(names)
+            for name in names:
+                self._reap(name)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _reap(self, name):
+        path = os.path.join(self.trash_root, name)
+        try:
+            with timed("rmtree"):
+                reclaimed = self.backend.remove_tree(path, self._throttle)
+        except OSError as e:
+            logger.error("Failed to reap %s: %s", path, e)
+            return
+        with self._lock:
+            self._pending.discard(name)
+        logger.log(V(2), "Reaped %s (%s bytes), %s left in trash", name, reclaimed, len(self._pending))
+
+    def _throttle(self, size):
+        self._pacer.wait()
+        with self._lock:
+            self._entries_reclaimed += 1
+            self._bytes_reclaimed += size
@@ -0,0 +1,275 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from concurrent import futures
+from csi.backend import OSBackend
+from csi.layout import IMAGE_FILE, TRASH_DIR, is_volume_name
+from csi.mount_table import MOUNTINFO, parse_mountinfo
+from csi.mounter import MountError
+from csi.quota import QuotaError
+from csi.metrics import timed
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+# Catalog rows read per query while loading it
+PAGE_SIZE = 5000
+# mountinfo marks the root of a bind mount whose source directory was removed
+DELETED_SUFFIX = "//deleted"
+
+ReconcileReport = namedtuple("ReconcileReport", [
+    "volumes",      # volumes in the catalog after reconciliation
+    "adopted",      # directories under VOLUME_ROOT that were missing from the catalog
+    "forgotten",    # catalog rows whose directory no longer exists
+    "discarded",    # unfinished clones and orphaned snapshot copies moved to the trash
+    "trash",        # entries waiting in the trash
+    "mounts",       # live bind mounts of volumes
+    "dangling",     # mounts of deleted volumes that were unmounted
+    "seconds",
+])
+
+
+class StartupReconciler:
+    """Brings the plugin's view back in line with the host after a restart.
+
+    The volume root, the catalog and /proc/self/mountinfo are read at the
+    same time on a small thread pool. Directory listings rely on the entry
+    types scandir returns, so checking 100k volumes costs a few getdents
+    calls per directory instead of one stat per volume; custom volume
+    paths are checked by listing their parent directories in parallel.
+
+    Controller side, the diff adopts directories a crashed CreateVolume
+    left behind, forgets rows of volumes a crashed DeleteVolume already
+    moved to the trash, and trashes unfinished clones and snapshot copies
+    nobody refers to. Node side, bind mounts of deleted volumes are
+    unmounted and live ones are handed back to the usage walker.
+    `ready` is set once everything is done, which is what Probe reports.
+    """
+
+    def __init__(self, volume_root, backend=None, controller=None, node=None, workers=8,
+                 mountinfo=MOUNTINFO):
+        self.volume_root = volume_root
+        self.backend = backend or OSBackend()
+        self.controller = controller
+        self.node = node
+        self.workers = workers
+        self.mountinfo = mountinfo
+        self.ready = threading.Event()
+        self.report = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            if self.controller is not None:
+                # Hold off volume and snapshot operations that would race the diff
+                self.controller.ready = self.ready
+            self._thread = threading.Thread(target=self._run, name="startup-reconciler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception:
+            # Still let the plugin serve; the state is no worse than without reconciling
+            logger.exception("Startup reconciliation failed")
+        finally:
+            self.ready.set()
+
+    def run(self):
+        started = time.monotonic()
+        if self.controller is not None:
+            # Not imported at module level: node-only plugins never load the controller
+            from csi.controller_service import SNAPSHOT_DIR, CLONE_DIR
+        with timed("reconcile"), futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                            thread_name_prefix="csi-reconcile") as pool:
+            trash = pool.submit(self._list, os.path.join(self.volume_root, TRASH_DIR))
+            mounts = pool.submit(self._read_mountinfo)
+            if self.controller is not None:
+                root = pool.submit(self._list, self.volume_root)
+                clones = pool.submit(self._list, os.path.join(self.volume_root, CLONE_DIR))
+                snapshot_dirs = pool.submit(self._list, os.path.join(self.volume_root, SNAPSHOT_DIR))
+                volumes = pool.submit(self._load, self.controller.catalog.list, "volume_id")
+                snapshots = pool.submit(self._load, self.controller.catalog.list_snapshots, "snapshot_id")
+
+            adopted = forgotten = discarded = 0
+            if self.controller is not None:
+                adopted, forgotten = self._reconcile_volumes(pool, root.result(), volumes.result())
+                discarded = self._discard_orphans(clones.result(), snapshot_dirs.result(), snapshots.result())
+            live, dangling = 0, 0
+            if self.node is not None:
+                live, dangling = self._reconcile_mounts(mounts.result())
+
+        count = self.controller.catalog.count() if self.controller is not None else 0
+        self.report = ReconcileReport(count, adopted, forgotten, discarded, len(trash.result()),
+                                      live, dangling, time.monotonic() - started)
+        logger.info("Startup reconciliation done in %.2fs: %s volumes, %s adopted, %s forgotten, "
+                    "%s discarded, %s in trash, %s mounts, %s dangling mounts removed",
+                    self.report.seconds, count, adopted, forgotten, discarded, len(trash.result()),
+                    live, dangling)
+        return self.report
+
+    def _list(self, path):
+        """name -> is directory for every entry of `path`, without stat calls where d_type is known."""
+        try:
+            return {entry.name: entry.is_dir(follow_symlinks=False) for entry in self.backend.scandir(path)}
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _load(page, key):
+        records = []
+        batch = page(limit=PAGE_SIZE)
+        while batch:
+            records.extend(batch)
+            batch = page(start_after=getattr(batch[-1], key), limit=PAGE_SIZE)
+        return records
+
+    def _read_mountinfo(self):
+        if self.node is None:
+            return []
+        with open(self.mountinfo) as f:
+            return parse_mountinfo(f.read())
+
+    def _exists_all(self, pool, paths):
+        """Which of `paths` exist, listing each parent directory once."""
+        parents = {}
+        for path in paths:
+            parents.setdefault(os.path.dirname(path), []).append(path)
+        listings = dict(zip(parents, pool.map(self._list, parents)))
+        return {path for parent, children in parents.items() for path in children
+                if os.path.basename(path) in listings[parent]}
+
+    def _reconcile_volumes(self, pool, root, records):
+        controller = self.controller
+        catalog = controller.catalog
+        known = {record.volume_id for record in records}
+
+        # Custom "path" volumes live elsewhere; only those need their parents listed
+        custom = [r.path for r in records if os.path.dirname(r.path) != self.volume_root.rstrip("/")]
+        existing = self._exists_all(pool, custom)
+        forgotten = 0
+        for record in records:
+            if os.path.dirname(record.path) == self.volume_root.rstrip("/"):
+                found = root.get(os.path.basename(record.path), False)
+            else:
+                found = record.path in existing
+            if found:
+                continue
+            # DeleteVolume moved it to the trash but died before updating the catalog
+            logger.warning("Volume %s is gone from %s, removing it from the catalog", record.volume_id, record.path)
+            catalog.remove(record.volume_id)
+            controller.capacity.release(record.capacity_bytes)
+            if controller.quota is not None and record.project_id is not None:
+                try:
+                    controller.quota.release(record.project_id)
+                except QuotaError as e:
+                    logger.warning("Failed to clear quota of volume %s: %s", record.volume_id, e)
+            forgotten += 1
+
+        # CreateVolume made the directory but died before recording it
+        orphans = [name for name, is_dir in root.items()
+                   if is_dir and is_volume_name(name) and name not in known]
+        contents = pool.map(self._list, [os.path.join(self.volume_root, name) for name in orphans])
+        for name, entries in zip(orphans, contents):
+            path = os.path.join(self.volume_root, name)
+            parameters, capacity = {}, 0
+            if IMAGE_FILE in entries:
+                parameters["backing"] = "image"
+                capacity = self.backend.stat(os.path.join(path, IMAGE_FILE)).st_size
+            logger.warning("Adopting volume directory %s missing from the catalog", path)
+            catalog.add(name, path, capacity, parameters)
+            controller.capacity.reserve(capacity)
+        return len(orphans), forgotten
+
+    def _discard_orphans(self, clones, snapshot_dirs, snapshots):
+        from csi.controller_service import SNAPSHOT_DIR, CLONE_DIR, INDEX_DIR
+        controller = self.controller
+        discarded = 0
+        # Every clone in progress died with the previous process
+        for name in clones:
+            controller._discard(os.path.join(self.volume_root, CLONE_DIR, name), f"clone-{name}")
+            discarded += 1
+
+        known = {}
+        for record in snapshots:
+            known[record.snapshot_id] = record
+        for name in snapshot_dirs:
+            if name == INDEX_DIR or name in known:
+                continue
+            controller._discard(os.path.join(self.volume_root, SNAPSHOT_DIR, name), f"snapshot-{name}")
+            discarded += 1
+        for record in known.values():
+            if record.ready and os.path.basename(record.path) not in snapshot_dirs \
+                    and os.path.dirname(record.path) == os.path.join(self.volume_root, SNAPSHOT_DIR):
+                logger.warning("Snapshot %s is gone from %s, removing it from the catalog",
+                               record.snapshot_id, record.path)
+                controller.forget_snapshot_index(record.snapshot_id)
+                controller.catalog.remove_snapshot(record.snapshot_id)
+        return discarded
+
+    def _volume_root_in(self, entries):
+        """Path of VOLUME_ROOT inside its filesystem, and that filesystem's device, as mountinfo shows them."""
+        real = os.path.realpath(self.volume_root)
+        best = None
+        for entry in entries:
+            point = entry.mount_point
+            if real != point and not real.startswith(point.rstrip("/") + "/"):
+                continue
+            # Longest mount point wins; later lines are mounted on top of earlier ones
+            if best is None or len(point) >= len(best.mount_point):
+                best = entry
+        if best is None:
+            return None, None
+        rel = os.path.relpath(real, best.mount_point)
+        return os.path.normpath(os.path.join(best.root, rel)), best.device
+
+    def _reconcile_mounts(self, entries):
+        node = self.node
+        inner, device = self._volume_root_in(entries)
+        if inner is None:
+            return 0, 0
+        prefix = inner.rstrip("/") + "/"
+        real_root = os.path.realpath(self.volume_root)
+        trash = prefix + TRASH_DIR + "/"
+        deleted_images = self._deleted_images(node)
+
+        live = dangling = 0
+        for entry in entries:
+            point = entry.mount_point
+            if point == real_root or point.startswith(real_root + "/"):
+                continue
+            if entry.device == device and entry.root.startswith(prefix):
+                stale = entry.root.endswith(DELETED_SUFFIX) or entry.root.startswith(trash)
+            elif entry.source in deleted_images:
+                stale = True
+            else:
+                continue
+            if not stale:
+                live += 1
+                if node.usage_walker is not None:
+                    node.usage_walker.track(point)
+                continue
+            try:
+                node.backend.unmount(point)
+                logger.info("Unmounted %s of deleted volume %s", point, entry.root)
+                dangling += 1
+            except MountError as e:
+                logger.warning("Failed to unmount dangling %s: %s", point, e)
+        for device_path in deleted_images:
+            try:
+                node.loop.detach(device_path)
+            except MountError as e:
+                logger.log(V(2), "Leaving %s attached: %s", device_path, e)
+        return live, dangling
+
+    def _deleted_images(self, node):
+        """Loop devices whose image file under VOLUME_ROOT has been deleted."""
+        real_root = os.path.realpath(self.volume_root) + "/"
+        deleted = set()
+        for device, backing in node.loop.devices().items():
+            if backing.startswith(real_root) and (backing.endswith(" (deleted)") or f"/{TRASH_DIR}/" in backing):
+                deleted.add(device)
+        return deleted
@@ -0,0 +1,132 @@
+import logging
+import threading
+from collections import namedtuple
+from csi.backend import OSBackend
+from csi.pacer import Pacer
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+# What a directory holds directly (not counting subdirectories), valid as
+# long as the directory's mtime is unchanged.
+_DirInfo = namedtuple("_DirInfo", ["mtime_ns", "own_bytes", "own_inodes", "subdirs"])
+
+
+class UsageWalker:
+    """Background per-volume disk usage accounting.
+
+    Tracked volume trees are scanned with backend.scandir on a background
+    thread, paced to `budget` stat/directory entries per second. Each
+    directory's own totals are cached against its mtime, so a rescan only
+    lists directories whose entries changed and just stats the rest. A
+    file growing in place does not touch its directory's mtime, so every
+    `full_rescan_every` passes all directories are listed again.
+    usage() only reads the cached totals.
+    """
+
+    def __init__(self, budget=5000, interval=60.0, full_rescan_every=10, backend=None):
+        self.backend = backend or OSBackend()
+        self.interval = interval
+        self.full_rescan_every = full_rescan_every
+        self._pacer = Pacer(budget)
+        self._lock = threading.Lock()
+        self._roots = {}    # root -> {dir path: _DirInfo}
+        self._totals = {}   # root -> (bytes, inodes)
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="usage-walker", daemon=True)
+            self._thread.start()
+        return self
+
+    def track(self, root):
+        with self._lock:
+            if root in self._roots:
+                return
+            self._roots[root] = {}
+        self._wakeup.set()
+
+    def untrack(self, root):
+        with self._lock:
+            self._roots.pop(root, None)
+            self._totals.pop(root, None)
+
+    def tracked(self):
+        with self._lock:
+            return sorted(self._roots)
+
+    def usage(self, root):
+        """Return (used_bytes, used_inodes) from the last scan, or None if not scanned yet."""
+        return self._totals.get(root)
+
+    def _run(self):
+        passes = 0
+        while True:
+            full = self.full_rescan_every > 0 and passes % self.full_rescan_every == 0
+            with self._lock:
+                roots = list(self._roots)
+            for root in roots:
+                try:
+                    with timed("usage_scan"):
+                        self._scan(root, full)
+                except OSError as e:
+                    logger.warning("Usage scan of %s failed: %s", root, e)
+            passes += 1
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _list_dir(self, path, mtime_ns):
+        own_bytes = own_inodes = 0
+        subdirs = []
+        for entry in self.backend.scandir(path):
+            self._pacer.wait()
+            own_inodes += 1
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            else:
+                own_bytes += entry.stat(follow_symlinks=False).st_blocks * 512
+        return _DirInfo(mtime_ns, own_bytes, own_inodes, subdirs)
+
+    def _scan(self, root, full):
+        with self._lock:
+            cache = self._roots.get(root)
+        if cache is None:
+            return
+
+        # Top-down: refresh each directory's own totals where it changed
+        scanned = {}
+        order = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            self._pacer.wait()
+            try:
+                mtime_ns = self.backend.stat(path).st_mtime_ns
+                info = cache.get(path)
+                if full or info is None or info.mtime_ns != mtime_ns:
+                    info = self._list_dir(path, mtime_ns)
+            except FileNotFoundError:
+                if path == root:
+                    raise
+                continue  # removed while we were walking
+            scanned[path] = info
+            order.append(path)
+            stack.extend(info.subdirs)
+
+        # Bottom-up: fold subdirectory totals into their parents
+        totals = {}
+        for path in reversed(order):
+            info = scanned[path]
+            nbytes, ninodes = info.own_bytes, info.own_inodes
+            for sub in info.subdirs:
+                sub_bytes, sub_inodes = totals.get(sub, (0, 0))
+                nbytes += sub_bytes
+                ninodes += sub_inodes
+            totals[path] = (nbytes, ninodes)
+
+        with self._lock:
+            if root in self._roots:
+                self._roots[root] = scanned
+                self._totals[root] = totals[root]
@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from csi.backend import OSBackend
+from csi.layout import is_volume_name
+
+logger = logging.getLogger('CSIPlugin')
+
+CATALOG_FILE = ".catalog.db"
+
+VolumeRecord = namedtuple(
+    "VolumeRecord",
+    ["volume_id", "path", "capacity_bytes", "created_at", "parameters", "project_id"],
+    defaults=(None,),
+)
+
+# Quota project ids handed out to volumes start here, clear of ids an
+# administrator is likely to have configured by hand.
+FIRST_PROJECT_ID = 100000
+
+_COLUMNS = "volume_id, path, capacity_bytes, created_at, parameters, project_id"
+
+SnapshotRecord = namedtuple(
+    "SnapshotRecord",
+    ["snapshot_id", "source_volume_id", "path", "size_bytes", "created_at", "ready", "group_snapshot_id"],
+    defaults=(None,),
+)
+
+_SNAPSHOT_COLUMNS = "snapshot_id, source_volume_id, path, size_bytes, created_at, ready, group_snapshot_id"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS volumes (
+    volume_id      TEXT PRIMARY KEY,
+    path           TEXT NOT NULL,
+    capacity_bytes INTEGER NOT NULL DEFAULT 0,
+    created_at     REAL NOT NULL,
+    parameters     TEXT NOT NULL DEFAULT '{}',
+    project_id     INTEGER
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    snapshot_id      TEXT PRIMARY KEY,
+    source_volume_id TEXT NOT NULL,
+    path             TEXT NOT NULL,
+    size_bytes       INTEGER NOT NULL DEFAULT 0,
+    created_at       REAL NOT NULL,
+    ready            INTEGER NOT NULL DEFAULT 0,
+    group_snapshot_id TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_by_source ON snapshots (source_volume_id, snapshot_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class VolumeCatalog:
+    """Persistent index of the volumes living under VOLUME_ROOT.
+
+    Backed by an embedded SQLite database stored next to the volumes, so
+    lookups go through the primary key index instead of the filesystem.
+    The catalog is rebuilt from the directory layout the first time it is
+    opened on an existing volume root.
+    """
+
+    def __init__(self, volume_root, db_path=None, backend=None):
+        self.volume_root = volume_root
+        self.backend = backend or OSBackend()
+        self.backend.makedirs(volume_root, exist_ok=True)
+        self.db_path = db_path or os.path.join(volume_root, CATALOG_FILE)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        if self.db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+        if self._get_meta("built") is None:
+            self.rebuild()
+        self.generation = int(self._get_meta("generation") or 0)
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(volumes)")}
+        if "project_id" not in columns:
+            self._conn.execute("ALTER TABLE volumes ADD COLUMN project_id INTEGER")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(snapshots)")}
+        if "group_snapshot_id" not in columns:
+            self._conn.execute("ALTER TABLE snapshots ADD COLUMN group_snapshot_id TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS snapshots_by_group ON snapshots (group_snapshot_id)")
+
+    def _get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    @staticmethod
+    def _to_record(row):
+        volume_id, path, capacity_bytes, created_at, parameters, project_id = row
+        return VolumeRecord(volume_id, path, capacity_bytes, created_at, json.loads(parameters), project_id)
+
+    def rebuild(self):
+        """Re-create the index from the directories found under VOLUME_ROOT.
+
+        Every rebuild starts a new catalog generation, which invalidates
+        list cursors handed out against the previous contents.
+        """
+        rows = []
+        for entry in self.backend.scandir(self.volume_root):
+            if not is_volume_name(entry.name) or not entry.is_dir(follow_symlinks=False):
+                continue
+            rows.append((entry.name, entry.path, 0, entry.stat().st_ctime, "{}"))
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM volumes")
+            self._conn.executemany(
+                "INSERT INTO volumes (volume_id, path, capacity_bytes, created_at, parameters) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._set_meta("built", time.time())
+            generation = int(self._get_meta("generation") or 0) + 1
+            self._set_meta("generation", generation)
+        self.generation = generation
+        logger.info("Volume catalog rebuilt from %s: %s volumes", self.volume_root, len(rows))
+
+    def get(self, volume_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM volumes WHERE volume_id = ?",
+                (volume_id,),
+            ).fetchone()
+        return self._to_record(row) if row else None
+
+    def _next_project_id(self):
+        # Never reuse ids: files of a deleted volume may still be charged
+        # to its project until the trash is reaped.
+        project_id = int(self._get_meta("next_project_id") or FIRST_PROJECT_ID)
+        self._set_meta("next_project_id", project_id + 1)
+        return project_id
+
+    def allocate_project_id(self):
+        """Reserve a quota project id ahead of add(), e.g. to label a volume while it is being filled."""
+        with self._lock, self._conn:
+            return self._next_project_id()
+
+    def add(self, volume_id, path, capacity_bytes=0, parameters=None, assign_project=False, project_id=None):
+        """Record a volume; with assign_project, also allocate it a fresh quota project id."""
+        with self._lock, self._conn:
+            if assign_project and project_id is None:
+                project_id = self._next_project_id()
+            record = VolumeRecord(volume_id, path, capacity_bytes, time.time(),
+                                  dict(parameters or {}), project_id)
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO volumes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+                (record.volume_id, record.path, record.capacity_bytes, record.created_at,
+                 json.dumps(record.parameters, sort_keys=True), record.project_id),
+            )
+        return record
+
+    def set_capacity(self, volume_id, capacity_bytes):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE volumes SET capacity_bytes = ? WHERE volume_id = ?",
+                               (capacity_bytes, volume_id))
+
+    def remove(self, volume_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM volumes WHERE volume_id = ?", (volume_id,))
+
+    def list(self, start_after="", limit=100):
+        """Return up to `limit` volumes ordered by id, strictly after `start_after`."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_COLUMNS} FROM volumes WHERE volume_id > ? ORDER BY volume_id LIMIT ?",
+                (start_after, limit),
+            ).fetchall()
+        return [self._to_record(row) for row in rows]
+
+    def total_capacity(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(capacity_bytes), 0) FROM volumes").fetchone()[0]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM volumes").fetchone()[0]
+
+    @staticmethod
+    def _to_snapshot(row):
+        snapshot_id, source_volume_id, path, size_bytes, created_at, ready, group_snapshot_id = row
+        return SnapshotRecord(snapshot_id, source_volume_id, path, size_bytes, created_at, bool(ready),
+                              group_snapshot_id)
+
+    def get_snapshot(self, snapshot_id):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_SNAPSHOT_COLUMNS} FROM snapshots WHERE snapshot_id = ?",
+                (snapshot_id,),
+            ).fetchone()
+        return self._to_snapshot(row) if row else None
+
+    def add_snapshot(self, snapshot_id, source_volume_id, path, group_snapshot_id=None):
+        """Record a snapshot whose copy has started; it is not ready until mark_snapshot_ready."""
+        record = SnapshotRecord(snapshot_id, source_volume_id, path, 0, time.time(), False, group_snapshot_id)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO snapshots ({_SNAPSHOT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (record.snapshot_id, record.source_volume_id, record.path, 0, record.created_at, 0,
+                 group_snapshot_id),
+            )
+        return record
+
+    def mark_snapshot_ready(self, snapshot_id, size_bytes):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE snapshots SET ready = 1, size_bytes = ? WHERE snapshot_id = ?",
+                (size_bytes, snapshot_id),
+            )
+
+    def remove_snapshot(self, snapshot_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM snapshots WHERE snapshot_id = ?", (snapshot_id,))
+
+    def group_snapshots(self, group_snapshot_id):
+        """Return the member snapshots of a group snapshot, ordered by id."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_SNAPSHOT_COLUMNS} FROM snapshots WHERE group_snapshot_id = ? ORDER BY snapshot_id",
+                (group_snapshot_id,),
+            ).fetchall()
+        return [self._to_snapshot(row) for row in rows]
+
+    def list_snapshots(self, start_after="", limit=100, source_volume_id=None):
+        """Return up to `limit` snapshots ordered by id, optionally only those of one volume."""
+        query = f"SELECT {_SNAPSHOT_COLUMNS} FROM snapshots WHERE snapshot_id > ?"
+        params = [start_after]
+        if source_volume_id is not None:
+            query += " AND source_volume_id = ?"
+            params.append(source_volume_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY snapshot_id LIMIT ?", (*params, limit)).fetchall()
+        return [self._to_snapshot(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
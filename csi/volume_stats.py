@@ -0,0 +1,71 @@
+import os
+import time
+import logging
+import threading
+from csi.backend import OSBackend
+from csi.metrics import timed
+
+logger = logging.getLogger('CSIPlugin')
+
+
+class FilesystemStatsCache:
+    """statvfs results cached per backing filesystem.
+
+    Volumes are grouped by the st_dev of their directory, so all volumes on
+    the same filesystem share a single statvfs call per refresh interval.
+    The path -> device mapping only changes if something is mounted over a
+    volume, so it is kept until the path is explicitly forgotten. Paths
+    under `root` (VOLUME_ROOT on the controller) are not stat()ed at all:
+    they share the device of `root`, looked up once.
+    """
+
+    def __init__(self, ttl=10.0, backend=None, root=None):
+        self.ttl = ttl
+        self.backend = backend or OSBackend()
+        self.root = root.rstrip("/") if root else None
+        self._root_dev = None
+        self._lock = threading.Lock()
+        self._devices = {}  # path -> st_dev
+        self._stats = {}    # st_dev -> (expires_at, statvfs_result)
+
+    def _device(self, path):
+        """(st_dev of `path`, path to statvfs for it)."""
+        if self.root is not None and path.startswith(self.root + os.sep):
+            if self._root_dev is None:
+                self._root_dev = self.backend.stat(self.root).st_dev
+            return self._root_dev, self.root
+        dev = self._devices.get(path)
+        if dev is None:
+            dev = self.backend.stat(path).st_dev
+            with self._lock:
+                self._devices[path] = dev
+        return dev, path
+
+    def statvfs(self, path):
+        dev, probe = self._device(path)
+        now = time.monotonic()
+        cached = self._stats.get(dev)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        with timed("statvfs"):
+            stat = self.backend.statvfs(probe)
+        with self._lock:
+            self._stats[dev] = (now + self.ttl, stat)
+        return stat
+
+    def capacity_bytes(self, paths):
+        """Return {path: total bytes of its filesystem}, skipping paths that vanished."""
+        result = {}
+        for path in paths:
+            try:
+                stat = self.statvfs(path)
+            except FileNotFoundError:
+                self.forget(path)
+                continue
+            result[path] = stat.f_blocks * stat.f_frsize
+        return result
+
+    def forget(self, path):
+        with self._lock:
+            self._devices.pop(path, None)
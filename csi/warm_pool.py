@@ -0,0 +1,189 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from collections import namedtuple, deque
+from csi.backend import OSBackend
+from csi.image import IMAGE_FILE, is_image_volume
+from csi.quota import QuotaError
+from csi.metrics import timed
+from csi.log import V
+
+logger = logging.getLogger('CSIPlugin')
+
+POOL_DIR = ".pool"
+
+PoolSpec = namedtuple("PoolSpec", ["size", "capacity_bytes", "parameters"])
+# A pre-built volume waiting in the pool
+PooledVolume = namedtuple("PooledVolume", ["path", "project_id"])
+
+
+def parse_pool_spec(text):
+    """Parse "SIZE:CAPACITY[:key=value,...]", e.g. "20:1073741824:backing=image"."""
+    fields = text.split(":", 2)
+    if len(fields) < 2:
+        raise ValueError(f"invalid warm pool {text!r}, expected SIZE:CAPACITY[:key=value,...]")
+    try:
+        size, capacity = int(fields[0]), int(fields[1])
+    except ValueError:
+        raise ValueError(f"invalid warm pool {text!r}, SIZE and CAPACITY must be integers") from None
+    parameters = {}
+    if len(fields) == 3 and fields[2]:
+        for item in fields[2].split(","):
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise ValueError(f"invalid warm pool parameter {item!r} in {text!r}")
+            parameters[key] = value
+    return PoolSpec(size, capacity, parameters)
+
+
+def pool_key(spec):
+    payload = json.dumps([spec.capacity_bytes, spec.parameters], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+class WarmPool:
+    """Pre-provisioned, anonymous volumes that CreateVolume can claim.
+
+    For every configured parameter set a background thread keeps `size`
+    volumes built under VOLUME_ROOT/.pool/<key>: the directory, the sparse
+    image for image-backed volumes and the quota project with its limit.
+    CreateVolume with the same parameters and a compatible capacity range
+    claims one with a single rename to its final path, so the slow steps
+    are off the request path. Claims wake the refiller immediately.
+
+    Pooled volumes are only tracked in memory; whatever a previous run
+    left under .pool has its quota limits cleared, is moved to the trash
+    at start and rebuilt.
+    """
+
+    def __init__(self, volume_root, specs, catalog, quota=None, backend=None, reaper=None, interval=30.0):
+        self.pool_root = os.path.join(volume_root, POOL_DIR)
+        self.specs = {pool_key(spec): spec for spec in specs}
+        self.catalog = catalog
+        self.quota = quota
+        self.backend = backend or OSBackend()
+        self.reaper = reaper
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._ready = {key: deque() for key in self.specs}
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._discard_leftovers()
+            self._thread = threading.Thread(target=self._run, name="warm-pool", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _discard_leftovers(self):
+        if not self.backend.exists(self.pool_root):
+            return
+        for name in self.backend.listdir(self.pool_root):
+            path = os.path.join(self.pool_root, name)
+            self._release_projects(path)
+            try:
+                if self.reaper is not None:
+                    self.reaper.move_to_trash(path, f"pool-{name}")
+                else:
+                    self.backend.rmtree(path)
+            except OSError as e:
+                logger.warning("Failed to discard stale pool %s: %s", path, e)
+
+    def _release_projects(self, pool_dir):
+        """Clear the quota limits of the volumes a previous run left in `pool_dir`."""
+        if self.quota is None:
+            return
+        try:
+            names = self.backend.listdir(pool_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(pool_dir, name)
+            try:
+                project_id = self.quota.project_of(path)
+                if project_id is not None:
+                    self.quota.release(project_id)
+            except (OSError, QuotaError) as e:
+                logger.warning("Failed to clear quota of stale pooled volume %s: %s", path, e)
+
+    def _run(self):
+        while not self._stopped:
+            for key, spec in self.specs.items():
+                while not self._stopped and len(self._ready[key]) < spec.size:
+                    try:
+                        volume = self._build(key, spec)
+                    except (OSError, QuotaError) as e:
+                        logger.error("Failed to pre-provision a volume for pool %s: %s", key, e)
+                        break
+                    with self._lock:
+                        self._ready[key].append(volume)
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _build(self, key, spec):
+        path = os.path.join(self.pool_root, key, uuid.uuid4().hex)
+        with timed("pool_build"):
+            self.backend.makedirs(path, exist_ok=True)
+            if is_image_volume(spec.parameters):
+                self.backend.truncate(os.path.join(path, IMAGE_FILE), spec.capacity_bytes)
+            project_id = None
+            if self.quota is not None:
+                project_id = self.catalog.allocate_project_id()
+                try:
+                    self.quota.assign(path, project_id, spec.capacity_bytes)
+                except QuotaError:
+                    self.backend.rmtree(path)
+                    raise
+        logger.log(V(4), "Pre-provisioned %s for pool %s", path, key)
+        return PooledVolume(path, project_id)
+
+    def _match(self, parameters, required_bytes, limit_bytes):
+        parameters = dict(parameters)
+        for key, spec in self.specs.items():
+            if spec.parameters != parameters:
+                continue
+            if spec.capacity_bytes < required_bytes or (limit_bytes and spec.capacity_bytes > limit_bytes):
+                continue
+            return key, spec
+        return None, None
+
+    def claim(self, path, parameters, capacity_range):
+        """Move a pooled volume matching the request to `path`.
+
+        Returns (capacity in bytes, quota project id) of the claimed volume,
+        or None when no pool matches or the matching pool is empty.
+        """
+        key, spec = self._match(parameters, capacity_range.required_bytes, capacity_range.limit_bytes)
+        if key is None:
+            return None
+        with self._lock:
+            volume = self._ready[key].popleft() if self._ready[key] else None
+        self._wakeup.set()
+        if volume is None:
+            logger.log(V(2), "Warm pool %s is empty", key)
+            return None
+        try:
+            self.backend.rename(volume.path, path)
+        except OSError as e:
+            # e.g. `path` already exists; fall back to creating the volume in place
+            logger.warning("Failed to claim %s from pool %s: %s", volume.path, key, e)
+            with self._lock:
+                self._ready[key].append(volume)
+            return None
+        if self.quota is not None and not self.quota.persistent:
+            # In-memory quotas are keyed by path; project ids on disk moved with the rename
+            self.quota.assign(path, volume.project_id, spec.capacity_bytes)
+        return spec.capacity_bytes, volume.project_id
+
+    def stats(self):
+        with self._lock:
+            return {key: len(ready) for key, ready in self._ready.items()}
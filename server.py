@@ -1,37 +1,171 @@
 from concurrent import futures
+import asyncio
 import grpc
 import logging
 from csi.options import parse_args
-from csi.identity_service import IdentityService
-from csi.controller_service import ControllerService
-from csi.node_service import NodeService
-from csi.csi_pb2_grpc import (
-    add_IdentityServicer_to_server,
-    add_ControllerServicer_to_server,
-    add_NodeServicer_to_server,
-)
-
-# Configure logging to include time, filename, and log message
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(filename)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
-
-logger = logging.getLogger('CSIPlugin')
+from csi.log import configure_logging
+from csi import metrics
 
 # Parse command line arguments
 args = parse_args()
 
+# Configure logging to include time, filename, and log message; records are
+# written by a background listener thread, filtered by --v
+configure_logging(args.v, rate=args.log_rate)
+
+logger = logging.getLogger('CSIPlugin')
+
+# Service modules are imported only for the roles this process serves, so a
+# node plugin never loads the controller, snapshot and catalog code.
+
+def build_controller(backend, quota):
+    from csi.controller_service import ControllerService
+    from csi.group_controller_service import GroupControllerService
+    from csi.snapshot_metadata_service import SnapshotMetadataService
+    from csi.reaper import TrashReaper
+    from csi.volume_catalog import VolumeCatalog
+    from csi.warm_pool import WarmPool, parse_pool_spec
+    from csi.csi_pb2_grpc import (
+        ControllerServicer,
+        GroupControllerServicer,
+        SnapshotMetadataServicer,
+        add_ControllerServicer_to_server,
+        add_GroupControllerServicer_to_server,
+        add_SnapshotMetadataServicer_to_server,
+    )
+
+    reaper = TrashReaper(args.volume_root, rate=args.reaper_rate, backend=backend)
+    metrics.REGISTRY.register(metrics.CallbackMetric(
+        "csi_trash_queue_depth", "Deleted volumes waiting to be purged.",
+        lambda: reaper.stats()["queue_depth"]))
+    metrics.REGISTRY.register(metrics.CallbackMetric(
+        "csi_trash_reclaimed_bytes_total", "Bytes freed by purging deleted volumes.",
+        lambda: reaper.stats()["bytes_reclaimed"], type="counter"))
+    catalog = VolumeCatalog(args.volume_root, backend=backend)
+    warm_pool = None
+    if args.warm_pool:
+        warm_pool = WarmPool(args.volume_root, [parse_pool_spec(spec) for spec in args.warm_pool], catalog,
+                             quota=quota, backend=backend, reaper=reaper, interval=args.warm_pool_interval)
+        metrics.REGISTRY.register(metrics.CallbackMetric(
+            "csi_warm_pool_ready", "Pre-provisioned volumes ready to be claimed.",
+            lambda: sum(warm_pool.stats().values())))
+    controller = ControllerService(args.volume_root, catalog=catalog, stats_ttl=args.stats_ttl, reaper=reaper,
+                                   capacity_refresh=args.capacity_refresh, quota=quota, backend=backend,
+                                   snapshot_wait=args.snapshot_wait,
+                                   warm_pool=warm_pool.start() if warm_pool else None)
+    return controller, [
+        (add_ControllerServicer_to_server, ControllerServicer, controller),
+        (add_GroupControllerServicer_to_server, GroupControllerServicer, GroupControllerService(controller)),
+        (add_SnapshotMetadataServicer_to_server, SnapshotMetadataServicer, SnapshotMetadataService(controller)),
+    ]
+
+def build_node(backend, quota, walker):
+    from csi.node_service import NodeService
+    from csi.csi_pb2_grpc import NodeServicer, add_NodeServicer_to_server
+
+    node = NodeService(args.nodeid, backend, quota=quota, usage_walker=walker, stats_ttl=args.stats_ttl)
+    return node, [(add_NodeServicer_to_server, NodeServicer, node)]
+
+def build_servicers():
+    from csi.identity_service import IdentityService
+    from csi.backend import new_backend
+    from csi.quota import new_quota_backend
+    from csi.reconciler import StartupReconciler
+    from csi.csi_pb2_grpc import IdentityServicer, add_IdentityServicer_to_server
+
+    serve_controller = args.mode in ("controller", "all")
+    serve_node = args.mode in ("node", "all")
+    backend = new_backend("os", args.mounter, copy_workers=args.copy_workers)
+    walker = None
+    if serve_node or args.quota == "simulated":
+        from csi.usage import UsageWalker
+        walker = UsageWalker(budget=args.usage_scan_budget, interval=args.usage_scan_interval,
+                             backend=backend).start()
+    quota = new_quota_backend(args.quota, args.volume_root, walker=walker, backend=backend)
+
+    controller = node = None
+    servicers = []
+    if serve_controller:
+        controller, added = build_controller(backend, quota)
+        servicers += added
+    if serve_node:
+        node, added = build_node(backend, quota, walker)
+        servicers += added
+    # Probe reports ready once the host state has been reconciled
+    reconciler = StartupReconciler(args.volume_root, backend, controller=controller, node=node,
+                                   workers=args.reconcile_workers).start()
+    identity = IdentityService(args.drivername, reconciler.ready, controller=serve_controller)
+    logger.info("Serving %s services", args.mode)
+    return [(add_IdentityServicer_to_server, IdentityServicer, identity)] + servicers
+
+def build_admission():
+    from csi.admission import AdmissionControl, parse_limit
+
+    if args.admission_concurrency <= 0 and not args.admission_limit:
+        return None
+    return AdmissionControl(concurrency=args.admission_concurrency, queue_depth=args.admission_queue,
+                            limits=dict(parse_limit(limit) for limit in args.admission_limit),
+                            max_concurrency=args.admission_max_concurrency,
+                            latency_target=args.admission_latency_target)
+
+def build_bulkheads():
+    from csi.bulkhead import Bulkheads
+
+    bulkheads = Bulkheads({"identity": args.identity_workers, "controller": args.controller_workers,
+                           "node": args.node_workers}, queue_depth=args.bulkhead_queue)
+    capacity = bulkheads.capacity()
+    if args.max_concurrent_rpcs and (capacity is None or capacity >= args.max_concurrent_rpcs):
+        logger.warning("Controller and node backlogs can fill all %s --max-concurrent-rpcs slots; "
+                       "Probe may be rejected under load", args.max_concurrent_rpcs)
+    return bulkheads
+
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    add_IdentityServicer_to_server(IdentityService(args.drivername), server)
-    add_ControllerServicer_to_server(ControllerService(args.volume_root), server)
-    add_NodeServicer_to_server(NodeService(args.nodeid), server)
+    from csi.admission import AdmissionInterceptor
+    from csi.bulkhead import BulkheadInterceptor
+
+    interceptors = [metrics.MetricsInterceptor()]
+    admission = build_admission()
+    if admission is not None:
+        interceptors.append(AdmissionInterceptor(admission))
+    bulkheads = build_bulkheads()
+    interceptors.append(BulkheadInterceptor(bulkheads))
+    # Server threads only wait on the bulkheads, one per RPC the server accepts
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=args.max_concurrent_rpcs or 100),
+                         interceptors=interceptors, maximum_concurrent_rpcs=args.max_concurrent_rpcs or None)
+    for add_to_server, _, servicer in build_servicers():
+        add_to_server(servicer, server)
     server.add_insecure_port(args.endpoint)
-    logger.info(f"Starting CSI plugin on {args.endpoint}...")
+    logger.info("Starting CSI plugin on %s...", args.endpoint)
     server.start()
     server.wait_for_termination()
 
+async def serve_async():
+    from csi.async_servicer import make_async_servicer
+
+    # Blocking filesystem and mount work is bounded by the pool of its
+    # service class; the event loop itself can hold any number of RPCs.
+    bulkheads = build_bulkheads()
+    from csi.admission import AsyncAdmissionInterceptor
+
+    interceptors = [metrics.AsyncMetricsInterceptor()]
+    admission = build_admission()
+    if admission is not None:
+        interceptors.append(AsyncAdmissionInterceptor(admission))
+    server = grpc.aio.server(interceptors=interceptors, maximum_concurrent_rpcs=args.max_concurrent_rpcs or None)
+    for add_to_server, base_cls, servicer in build_servicers():
+        add_to_server(make_async_servicer(servicer, base_cls, bulkheads.executor(base_cls.__name__)), server)
+    server.add_insecure_port(args.endpoint)
+    logger.info("Starting CSI plugin (asyncio) on %s...", args.endpoint)
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        bulkheads.shutdown()
+
 if __name__ == "__main__":
-    serve()
\ No newline at end of file
+    if args.metrics_address:
+        metrics.start_http_server(args.metrics_address)
+    if args.async_mode:
+        asyncio.run(serve_async())
+    else:
+        serve()
@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only the controller needs; a node plugin must come up without them
+CONTROLLER_ONLY = ["sqlite3", "csi.volume_catalog", "csi.reaper", "csi.copy_engine", "csi.image",
+                   "csi.controller_service"]
+
+# server.py parses its arguments at import time, so build the servicers in a
+# fresh interpreter with a node command line and report what it loaded.
+SCRIPT = """
+import json, os, sys
+sys.argv = ["server.py", "--drivername", "test", "--endpoint", "unix:///tmp/test.sock",
+            "--nodeid", "node", "--volume-root", sys.argv[1], "--mode", "node"]
+import server
+server.build_servicers()
+print(json.dumps(sorted(sys.modules)))
+sys.stdout.flush()
+os._exit(0)
+"""
+
+
+def test_node_mode_does_not_load_controller_modules(tmp_path):
+    result = subprocess.run([sys.executable, "-c", SCRIPT, str(tmp_path)], cwd=REPO,
+                            capture_output=True, text=True, timeout=60, check=True)
+    loaded = set(json.loads(result.stdout.splitlines()[-1]))
+    assert "csi.node_service" in loaded
+    assert [name for name in CONTROLLER_ONLY if name in loaded] == []
@@ -0,0 +1,42 @@
+import os
+import time
+
+from csi.backend import FakeBackend
+from csi.csi_pb2 import CapacityRange
+from csi.quota import SimulatedQuota
+from csi.usage import UsageWalker
+from csi.volume_catalog import VolumeCatalog
+from csi.warm_pool import POOL_DIR, WarmPool, parse_pool_spec
+
+ROOT = "/volumes"
+
+
+def wait_ready(pool, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while sum(pool.stats().values()) < count:
+        assert time.monotonic() < deadline, "warm pool was not filled"
+        time.sleep(0.01)
+
+
+def test_claim_moves_simulated_quota_to_the_volume():
+    backend = FakeBackend()
+    backend.makedirs(ROOT)
+    walker = UsageWalker(backend=backend)  # not started: only the tracked roots matter here
+    quota = SimulatedQuota(walker=walker, backend=backend)
+    catalog = VolumeCatalog(ROOT, db_path=":memory:", backend=backend)
+    pool = WarmPool(ROOT, [parse_pool_spec("2:1048576")], catalog, quota=quota, backend=backend).start()
+    try:
+        wait_ready(pool, 2)
+        path = os.path.join(ROOT, "v1")
+        capacity, project_id = pool.claim(path, {}, CapacityRange(required_bytes=1048576))
+        assert capacity == 1048576
+
+        pooled = [root for root in walker.tracked() if f"/{POOL_DIR}/" in root]
+        assert path in walker.tracked()
+        assert len(pooled) == 1  # the volume still waiting in the pool
+        assert quota.project_of(path) == project_id
+
+        quota.release(project_id)
+        assert path not in walker.tracked()
+    finally:
+        pool.stop()